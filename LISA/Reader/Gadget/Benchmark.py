@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the gadget reader on synthetic snapshots:
+
+    python3 -m LISA.Reader.Gadget.Benchmark --particles 10000000 --files 4
+
+Each mode of the reader is timed in its own process, so that the peak
+resident memory reported is the one of the mode alone. The snapshots are
+read just after being written, so the timings are the ones of a warm page
+cache unless the caches are dropped between the runs.
+"""
+
+import os
+import sys
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .Catalog import HEADER
+from .Reader import GadgetReader, BLOCKS
+from .Reader import _block_npart, _format1_labels, _split_npart
+
+
+# the modes of the reader which are timed
+MODES = ("full", "lazy", "mmap", "types", "chunked", "multi-file")
+
+# the number of elements generated and written at once
+CHUNK = 1 << 22
+
+
+def _record(f, nbytes, endian, label=None):
+    """
+    Write the marker opening a record, preceded in the format 2 by the
+    record of its label. Return the marker closing it.
+    """
+    marker = np.dtype(endian + "i4")
+    if label is not None:
+        np.array([8], dtype=marker).tofile(f)
+        f.write(label.encode())
+        np.array([nbytes + 8, 8], dtype=marker).tofile(f)
+    np.array([nbytes], dtype=marker).tofile(f)
+    return np.array([nbytes], dtype=marker)
+
+
+def _write_file(filename, npart, npart_total, mass, num_files, format,
+                endian, dtype, first_id, rng):
+    header = np.zeros(1, dtype=HEADER.newbyteorder(endian))
+    header["npart"] = npart
+    header["mass"] = mass
+    header["time"] = 1.
+    header["npartTotal"] = [n & 0xFFFFFFFF for n in npart_total]
+    header["npartTotalHighWord"] = [n >> 32 for n in npart_total]
+    header["num_files"] = num_files
+    header["BoxSize"] = 1.
+    header["Omega0"] = 0.3
+    header["OmegaLambda"] = 0.7
+    header["HubbleParam"] = 0.7
+
+    with open(filename, "wb") as f:
+        end = _record(f, HEADER.itemsize, endian, "HEAD" if format == 2
+                      else None)
+        header.tofile(f)
+        end.tofile(f)
+
+        for label in _format1_labels(npart, mass):
+            nb = sum(_block_npart(label, npart, mass)) * BLOCKS[label][0]
+            if label == "ID  ":
+                kind = np.dtype(endian + "u4")
+            else:
+                kind = np.dtype(endian + dtype)
+            end = _record(f, nb * kind.itemsize, endian,
+                          label if format == 2 else None)
+            for start in range(0, nb, CHUNK):
+                count = min(CHUNK, nb - start)
+                if label == "ID  ":
+                    values = np.arange(
+                        first_id + start, first_id + start + count
+                    )
+                else:
+                    values = rng.random_sample(count)
+                values.astype(kind).tofile(f)
+            end.tofile(f)
+
+
+def generate(filename, npart, num_files=1, format=1, endian="=",
+             dtype="f4", seed=0):
+    """
+    Write a synthetic snapshot with uniform random positions, velocities,
+    masses of the gas and gas properties, and consecutive identities. The
+    data is generated by chunks, so snapshots larger than the memory can be
+    written.
+
+    :params filename: the file of the snapshot, or the base name of the files
+        of a multi-file one.
+    :params npart: the number of particles of each type.
+    :params num_files: the number of files of the snapshot.
+    :params format: the gadget format, 1 or 2.
+    :params endian: the byte order of the files, "<", ">" or "=".
+    :params dtype: the type of the floating point blocks, "f4" or "f8".
+    :params seed: the seed of the random values.
+    :return: the names of the files written.
+    """
+    if format not in (1, 2):
+        raise ValueError("Only the formats 1 and 2 can be generated.")
+
+    rng = np.random.RandomState(seed)
+    # the gas has individual masses, the other types the ones of the header
+    mass = [0.] + [1.] * 5
+    filenames = []
+    first_id = 0
+    for i, nb in enumerate(_split_npart(npart, num_files)):
+        name = filename if num_files == 1 else "{0}.{1}".format(filename, i)
+        _write_file(name, nb, npart, mass, num_files, format, endian, dtype,
+                    first_id, rng)
+        filenames.append(name)
+        first_id += sum(nb)
+    return filenames
+
+
+def _nbytes(reader, label, types=None):
+    """
+    The size in the files of the particles of the given types of a block.
+    """
+    return sum(size for _, _, size in reader._ranges(label, types))
+
+
+def _reset_peak_rss():
+    """
+    Reset the peak resident memory of the process to the current one, where
+    the system allows it (linux), so the imports are not counted in it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except (IOError, OSError):
+        pass
+
+
+def _status(field):
+    """
+    A memory field of /proc/self/status in bytes, None if not available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def _peak_rss():
+    """
+    The peak resident memory of the process, in bytes.
+    """
+    peak = _status("VmHWM")
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on mac os
+        if sys.platform != "darwin":
+            peak *= 1024
+    return peak
+
+
+def _rss():
+    """
+    The resident memory of the process, in bytes, or its peak where the
+    current one isn't known.
+    """
+    rss = _status("VmRSS")
+    return _peak_rss() if rss is None else rss
+
+
+def _run(mode, filename, numfile, format):
+    """
+    Time a mode of the reader, in a process of its own. Return the time, the
+    number of bytes read, the peak resident memory and its increase during
+    the run.
+    """
+    _reset_peak_rss()
+    baseline = _rss()
+    start = time.perf_counter()
+    reader = GadgetReader(filename, numfile)
+    if mode == "mmap":
+        reader.Read(format=format, mmap=True)
+        # touch every page of the positions
+        np.add.reduce(reader.positions, dtype=np.float64)
+        nbytes = _nbytes(reader, "POS ")
+    elif mode == "types":
+        reader.Read(format=format, types=[1])
+        reader.positions
+        nbytes = _nbytes(reader, "POS ", [1])
+    elif mode == "chunked":
+        reader.Read(format=format)
+        for chunk in reader.iter_chunks("POS "):
+            pass
+        nbytes = _nbytes(reader, "POS ")
+    elif mode == "lazy":
+        reader.Read(format=format)
+        reader.positions
+        nbytes = _nbytes(reader, "POS ")
+    else:
+        reader.Read(format=format)
+        for label in reader.blocks:
+            reader.block(label)
+        nbytes = sum(_nbytes(reader, label) for label in reader.blocks)
+    elapsed = time.perf_counter() - start
+    peak = _peak_rss()
+    return elapsed, nbytes, peak, peak - baseline
+
+
+def benchmark(npart, num_files=4, formats=(1, 2), endian="=", dtype="f4",
+              modes=MODES, repeat=3, directory=None):
+    """
+    Generate synthetic snapshots and time every mode of the reader on them,
+    keeping the best of repeat runs. The multi-file mode reads a snapshot
+    split into num_files files, the other ones a single file.
+
+    :return: a list of dictionaries giving the format, the mode, the time in
+        seconds, the throughput in GB/s and the peak resident memory in
+        bytes of each run.
+    """
+    tmp = tempfile.mkdtemp(dir=directory, prefix="gadget-benchmark-")
+    results = []
+    try:
+        for format in formats:
+            single = os.path.join(tmp, "snapshot_{0}".format(format))
+            multi = os.path.join(tmp, "multi_{0}".format(format))
+            generate(single, npart, 1, format, endian, dtype)
+            if "multi-file" in modes:
+                generate(multi, npart, num_files, format, endian, dtype)
+
+            for mode in modes:
+                if mode not in MODES:
+                    raise ValueError("Unknown mode '{0}'.".format(mode))
+                if mode == "multi-file":
+                    args = (mode, multi, num_files, format)
+                else:
+                    args = (mode, single, 1, format)
+
+                # a fresh interpreter, not inheriting the peak memory of the
+                # generation
+                context = multiprocessing.get_context("spawn")
+                runs = []
+                for i in range(repeat):
+                    with ProcessPoolExecutor(1, mp_context=context) as pool:
+                        runs.append(pool.submit(_run, *args).result())
+                elapsed, nbytes, peak, growth = min(runs)
+                results.append({
+                    "format": format,
+                    "mode": mode,
+                    "time": elapsed,
+                    "bytes": nbytes,
+                    "throughput": nbytes / elapsed / 1e9,
+                    "peak_rss": max(run[2] for run in runs),
+                    "rss_increase": max(run[3] for run in runs),
+                })
+    finally:
+        shutil.rmtree(tmp)
+    return results
+
+
+def report(results, out=sys.stdout):
+    """
+    Print the results of a benchmark as a table.
+    """
+    out.write("{0:>6} {1:>10} {2:>10} {3:>10} {4:>10} {5:>12}\n".format(
+        "format", "mode", "time (s)", "GB/s", "RSS (MB)", "+RSS (MB)"
+    ))
+    for r in results:
+        out.write(
+            "{0:>6} {1:>10} {2:>10.4f} {3:>10.3f} {4:>10.1f} {5:>12.1f}\n"
+            .format(
+                r["format"], r["mode"], r["time"], r["throughput"],
+                r["peak_rss"] / 2**20, r["rss_increase"] / 2**20,
+            )
+        )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the gadget reader on synthetic snapshots."
+    )
+    parser.add_argument("--particles", type=int, default=2000000,
+                        help="the number of particles of each of the gas "
+                        "and dark matter types")
+    parser.add_argument("--files", type=int, default=4,
+                        help="the number of files of the multi-file mode")
+    parser.add_argument("--format", type=int, nargs="+", default=[1, 2],
+                        choices=[1, 2], help="the gadget formats")
+    parser.add_argument("--endian", default="=", choices=["<", ">", "="],
+                        help="the byte order of the files")
+    parser.add_argument("--dtype", default="f4", choices=["f4", "f8"],
+                        help="the type of the floating point blocks")
+    parser.add_argument("--modes", nargs="+", default=list(MODES),
+                        choices=MODES, help="the modes of the reader timed")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="the number of runs of each mode")
+    parser.add_argument("--directory", default=None,
+                        help="the directory of the temporary snapshots")
+    options = parser.parse_args(args)
+
+    npart = [options.particles, options.particles, 0, 0, 0, 0]
+    report(benchmark(
+        npart, options.files, options.format, options.endian, options.dtype,
+        options.modes, options.repeat, options.directory,
+    ))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: set tw=79 :
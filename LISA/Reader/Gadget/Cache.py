@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from LISA.tools.common import CACHE_DIR
+from .Reader import GadgetReader, ParticleType, BLOCKS, NAMES, ORDER
+
+
+# the header fields kept in the manifest
+HEADER_FIELDS = (
+    "mass", "time", "redshift", "flag_sfr", "flag_feedback", "flag_cooling",
+    "num_files", "BoxSize", "Omega0", "OmegaLambda", "HubbleParam",
+    "flag_stellarage", "flag_metals", "flag_entropy_instead_u",
+)
+
+MANIFEST = "manifest.json"
+
+# the version of the layout of the cache directories
+VERSION = 2
+
+
+def cache_directory(filename):
+    """
+    The default cache directory of a snapshot, in the user cache directory.
+    """
+    key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, "gadget", key)
+
+
+def _sources(filenames):
+    """
+    The key of the cache: the size and modification time of the files.
+    """
+    sources = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        sources.append({
+            "filename": os.path.abspath(filename),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        })
+    return sources
+
+
+def export_cache(reader, directory=None):
+    """
+    Export the decoded blocks of a read snapshot into a cache directory: one
+    .npy file by block, the particles sorted by type, with a JSON manifest
+    holding the header and the offsets of the types in the blocks. The
+    reader must have been read without subsampling.
+    """
+    if reader.subsample is not None:
+        raise ValueError(
+            "The cache holds whole snapshots: read without subsample."
+        )
+
+    if directory is None:
+        directory = cache_directory(reader.filename)
+
+    # the manifest is written last, so an interrupted export is not valid
+    manifest = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    os.makedirs(directory, exist_ok=True)
+
+    # each block in one file, the particles sorted by type, with the
+    # offsets of the types in it
+    blocks = {}
+    for label in [label for label in ORDER if label in reader.blocks]:
+        arrays = [reader._read_types(label, [ptype]) for ptype in range(6)]
+        if all(array is None for array in arrays):
+            continue
+        arrays = [
+            np.empty(0, dtype=np.float32) if array is None else array
+            for array in arrays
+        ]
+        offsets = np.concatenate(
+            [[0], np.cumsum([array.size for array in arrays])]
+        )
+        dtype = next(
+            (array.dtype for array in arrays if array.size), arrays[0].dtype
+        ).newbyteorder("=")
+
+        name = "{0}.npy".format(label.strip().lower())
+        block = np.lib.format.open_memmap(
+            os.path.join(directory, name),
+            mode="w+",
+            dtype=dtype,
+            shape=(int(offsets[-1]),),
+        )
+        for ptype, array in enumerate(arrays):
+            block[offsets[ptype]:offsets[ptype + 1]] = array
+        block.flush()
+        del block, arrays
+
+        blocks[label] = {"file": name, "offsets": offsets.tolist()}
+
+    header = {field: getattr(reader, field) for field in HEADER_FIELDS}
+    with open(manifest, "w") as f:
+        json.dump(
+            {
+                "version": VERSION,
+                "sources": _sources(reader._filenames()),
+                "header": header,
+                "blocks": blocks,
+            },
+            f,
+            indent=4,
+        )
+
+    return directory
+
+
+def _clear_cache(directory):
+    """
+    Remove the manifest of a cache directory and the files of the blocks it
+    lists, leaving the other files of the directory.
+    """
+    manifest = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest) as f:
+            blocks = json.load(f).get("blocks", {})
+    except (IOError, OSError, ValueError, AttributeError):
+        blocks = {}
+    os.remove(manifest)
+
+    for block in blocks.values():
+        # a file by block, or by block and type in the first layout
+        names = [block.get("file")] if "file" in block else block.values()
+        for name in names:
+            path = os.path.join(directory, os.path.basename(str(name)))
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+class CachedSnapshot(object):
+    """
+    A snapshot read from its cache directory, whose blocks are memory mapped
+    the first time they are accessed.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+
+        if manifest.get("version") != VERSION:
+            raise ValueError(
+                "The cache {0} has an older layout.".format(directory)
+            )
+
+        self._directory = directory
+        self._sources = manifest["sources"]
+        self._header = manifest["header"]
+        self._files = manifest["blocks"]
+        self._blocks = {}
+        self._views = {}
+        self._particle_types = {}
+
+    @property
+    def filename(self):
+        return self._sources[0]["filename"]
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def blocks(self):
+        return [label for label in ORDER if label in self._files]
+
+    @property
+    def npart(self):
+        if "ID  " not in self._files:
+            return [0] * 6
+        offsets = self._files["ID  "]["offsets"]
+        return [offsets[i + 1] - offsets[i] for i in range(6)]
+
+    @property
+    def time(self):
+        return self._header["time"]
+
+    @property
+    def redshift(self):
+        return self._header["redshift"]
+
+    @property
+    def BoxSize(self):
+        return self._header["BoxSize"]
+
+    @property
+    def mass(self):
+        return self._header["mass"]
+
+    def valid(self):
+        """
+        Tell if the source files are unchanged since the export.
+        """
+        try:
+            sources = _sources(s["filename"] for s in self._sources)
+        except OSError:
+            return False
+        return all(
+            s["size"] == o["size"] and s["mtime"] == o["mtime"]
+            for s, o in zip(sources, self._sources)
+        )
+
+    def _view(self, label):
+        """
+        The memory mapped file of a block.
+        """
+        if label not in self._views:
+            self._views[label] = np.load(
+                os.path.join(self._directory, self._files[label]["file"]),
+                mmap_mode="r",
+            )
+        return self._views[label]
+
+    def _read_types(self, label, types=None):
+        """
+        The particles of the given types of a block, as a slice of its
+        mapped file when the types are adjacent, else copied.
+        """
+        if label not in self._files:
+            return None
+        view = self._view(label)
+        if types is None:
+            return view
+
+        offsets = self._files[label]["offsets"]
+        slices = []
+        for ptype in sorted(types):
+            start, end = offsets[ptype], offsets[ptype + 1]
+            if slices and slices[-1][1] == start:
+                slices[-1] = (slices[-1][0], end)
+            elif end > start:
+                slices.append((start, end))
+        if not slices:
+            return view[:0]
+        if len(slices) == 1:
+            return view[slices[0][0]:slices[0][1]]
+        return np.concatenate([view[start:end] for start, end in slices])
+
+    def block(self, label):
+        label = NAMES.get(label, label)
+        if label not in BLOCKS:
+            raise KeyError("Unknown block '{0}'.".format(label))
+        if label not in self._blocks:
+            array = self._read_types(label)
+            if array is None:
+                raise KeyError(
+                    "No block '{0}' in {1}.".format(label, self._directory)
+                )
+            self._blocks[label] = array
+        return self._blocks[label]
+
+    def drop(self, label):
+        self._blocks.pop(NAMES.get(label, label), None)
+
+    def type(self, ptype):
+        if ptype not in self._particle_types:
+            self._particle_types[ptype] = ParticleType(self, ptype)
+        return self._particle_types[ptype]
+
+    @property
+    def positions(self):
+        return self.block("POS ")
+
+    @property
+    def velocities(self):
+        return self.block("VEL ")
+
+    @property
+    def ids(self):
+        return self.block("ID  ")
+
+    @property
+    def masses(self):
+        return self.block("MASS")
+
+    @property
+    def internal_energy(self):
+        return self.block("U   ")
+
+    @property
+    def density(self):
+        return self.block("RHO ")
+
+    @property
+    def smoothing_length(self):
+        return self.block("HSML")
+
+
+def open_snapshot(filename, numfile=1, format=1, directory=None, **kwargs):
+    """
+    Open a snapshot through its cache: the first time, the snapshot is read
+    and exported into the cache, next times the cache is memory mapped as
+    long as the size and modification time of the files are unchanged. The
+    keyword arguments (flags of the optional blocks, mmap...) are passed to
+    GadgetReader.Read, but not subsample nor types: the cache holds the
+    whole snapshot.
+    """
+    if kwargs.get("subsample") is not None or \
+            kwargs.get("types") is not None:
+        raise ValueError(
+            "The cache holds whole snapshots: read without subsample nor "
+            "types, then use type() on the cached snapshot."
+        )
+
+    if directory is None:
+        directory = cache_directory(filename)
+
+    if os.path.isfile(os.path.join(directory, MANIFEST)):
+        try:
+            snapshot = CachedSnapshot(directory)
+        except (ValueError, KeyError):
+            snapshot = None
+        if snapshot is not None and snapshot.valid():
+            return snapshot
+        _clear_cache(directory)
+
+    reader = GadgetReader(filename, numfile)
+    reader.Read(format=format, **kwargs)
+    return CachedSnapshot(export_cache(reader, directory))
+
+# vim: set tw=79 :
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the io_header of the gadget files
+HEADER = np.dtype([
+    ("npart", "i4", 6),
+    ("mass", "f8", 6),
+    ("time", "f8"),
+    ("redshift", "f8"),
+    ("flag_sfr", "i4"),
+    ("flag_feedback", "i4"),
+    ("npartTotal", "u4", 6),
+    ("flag_cooling", "i4"),
+    ("num_files", "i4"),
+    ("BoxSize", "f8"),
+    ("Omega0", "f8"),
+    ("OmegaLambda", "f8"),
+    ("HubbleParam", "f8"),
+    ("flag_stellarage", "i4"),
+    ("flag_metals", "i4"),
+    ("npartTotalHighWord", "u4", 6),
+    ("flag_entropy_instead_u", "i4"),
+    ("fill", "V60"),
+])
+
+# an entry of the catalogue
+ENTRY = np.dtype([
+    ("filename", "U255"),
+    ("size", "i8"),
+    ("mtime", "f8"),
+    ("time", "f8"),
+    ("redshift", "f8"),
+    ("npart", "i8", 6),
+    ("npartTotal", "i8", 6),
+    ("num_files", "i4"),
+    ("BoxSize", "f8"),
+])
+
+
+def read_header(filename):
+    """
+    Read only the header of a gadget file in format 1 or 2, of any byte
+    order.
+    """
+    with open(filename, "rb") as f:
+        marker = np.fromfile(f, dtype=np.int32, count=1)
+        if marker.size != 1:
+            raise IOError("{0} is not a gadget file.".format(filename))
+
+        # the byte order is given by the first record marker
+        header = HEADER
+        if marker[0] not in (8, HEADER.itemsize):
+            marker = marker.byteswap()
+            header = HEADER.newbyteorder()
+
+        # skip the label of the header block in the format 2
+        if marker[0] == 8:
+            f.seek(16)
+            marker = np.fromfile(f, dtype=marker.dtype, count=1)
+            if header is not HEADER:
+                marker = marker.byteswap()
+
+        if marker.size != 1 or marker[0] != HEADER.itemsize:
+            raise IOError("{0} is not a gadget file.".format(filename))
+
+        # a file being written may stop in its header
+        header = np.fromfile(f, dtype=header, count=1)
+        if header.size != 1:
+            raise IOError("{0} is truncated.".format(filename))
+        return header[0]
+
+
+class GadgetCatalog(object):
+    """
+    A catalogue of the snapshots of a simulation directory, built from the
+    headers of the files only.
+    """
+
+    def __init__(
+        self,
+        directory,
+        pattern="*",
+        index=".gadget_catalog.npy",
+        threads=None,
+    ):
+        """
+        A catalogue of the snapshots of a simulation directory.
+
+        :params directory: the directory containing the snapshots.
+        :params pattern: a glob pattern matching the snapshot files.
+        :params index: the name of the file, in the directory, in which the
+            catalogue is kept between sessions.
+        :params threads: the number of threads reading the headers.
+        """
+        self._directory = directory
+        self._pattern = pattern
+        self._index = os.path.join(directory, index)
+        self._threads = threads
+        self.refresh()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def table(self):
+        return self._table
+
+    def __len__(self):
+        return len(self._table)
+
+    def __getitem__(self, item):
+        return self._table[item]
+
+    def refresh(self):
+        """
+        Update the catalogue, reading only the headers of the files which
+        are new or have changed since the index was written.
+        """
+        # the entries of the index, by file name
+        known = {}
+        if os.path.isfile(self._index):
+            try:
+                for entry in np.load(self._index):
+                    known[str(entry["filename"])] = entry
+            except (IOError, ValueError):
+                known = {}
+
+        entries = []
+        missing = []
+        for path in sorted(
+            glob.glob(os.path.join(self._directory, self._pattern))
+        ):
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            filename = os.path.basename(path)
+            entry = known.get(filename)
+            if entry is not None and entry["size"] == stat.st_size and \
+                    entry["mtime"] == stat.st_mtime:
+                entries.append(entry)
+            else:
+                missing.append((path, stat))
+
+        with ThreadPoolExecutor(self._threads) as pool:
+            headers = list(pool.map(self._try_header, missing))
+
+        for (path, stat), header in zip(missing, headers):
+            if header is None:
+                continue
+            entry = np.zeros(1, dtype=ENTRY)[0]
+            entry["filename"] = os.path.basename(path)
+            entry["size"] = stat.st_size
+            entry["mtime"] = stat.st_mtime
+            entry["time"] = header["time"]
+            entry["redshift"] = header["redshift"]
+            entry["npart"] = header["npart"]
+            entry["npartTotal"] = header["npartTotal"].astype(np.int64) + (
+                header["npartTotalHighWord"].astype(np.int64) << 32
+            )
+            entry["num_files"] = header["num_files"]
+            entry["BoxSize"] = header["BoxSize"]
+            entries.append(entry)
+
+        table = np.array(entries, dtype=ENTRY)
+        self._table = table[np.argsort(table["filename"], kind="mergesort")]
+
+        # write the index only if something changed
+        changed = any(header is not None for header in headers)
+        if changed or len(known) != len(self._table):
+            try:
+                np.save(self._index, self._table)
+            except IOError:
+                pass
+
+    def _try_header(self, file_stat):
+        try:
+            return read_header(file_stat[0])
+        except IOError:
+            return None
+
+    def path(self, item):
+        """
+        The full path of the file of an entry.
+        """
+        return os.path.join(self._directory, self._table[item]["filename"])
+
+    def nearest(self, redshift=None, time=None):
+        """
+        The entry of the snapshot the nearest of a redshift or a time.
+        """
+        if redshift is not None:
+            return self._table[
+                np.argmin(np.abs(self._table["redshift"] - redshift))
+            ]
+        if time is not None:
+            return self._table[np.argmin(np.abs(self._table["time"] - time))]
+        raise ValueError("A redshift or a time is needed.")
+
+# vim: set tw=79 :
@@ -10,6 +10,8 @@ from OpenGL.arrays import numpymodule
 numpymodule.NumpyHandler.ERROR_ON_COPY = True
 
 from .Reader import GadgetReader
+from .Sequence import SnapshotSequence
+from .HDF5 import GadgetHDF5
 from LISA import Object as o
 from LISA import Matrice as m
 
@@ -22,8 +24,30 @@ class Simu(o.Base):
             del kwargs["numfile"]
         else:
             num = 1
-        fich = GadgetReader(filename, num)
-        fich.Read()
+        if "subsample" in kwargs:
+            subsample = kwargs["subsample"]
+            del kwargs["subsample"]
+        else:
+            subsample = None
+        if "format" in kwargs:
+            form = kwargs["format"]
+            del kwargs["format"]
+        else:
+            form = 1
+        if isinstance(filename, SnapshotSequence):
+            self._sequence = filename
+            # the snapshots are read as the sequence reads them
+            form = filename.format
+            fich = filename.current
+        else:
+            self._sequence = None
+            if form == 3:
+                fich = GadgetHDF5(filename, num)
+            else:
+                fich = GadgetReader(filename, num)
+            fich.Read(format=form, subsample=subsample)
+        self._format = form
+        self._reader = fich
 
         self._sigma = 0.2
         self._size = 0.01
@@ -34,6 +58,23 @@ class Simu(o.Base):
         self._shaders += c.shader_path("halo/halo.vsh")
         self._shaders += c.shader_path("halo/halo.fsh")
 
+    def refine(self):
+        """
+        Replace a subsampled preview by the particles at full resolution.
+        """
+        self._reader.Read(format=self._format)
+        self.data = self._reader.positions
+
+    def step(self, n=1):
+        """
+        Show the snapshot n steps further in the sequence, already read in
+        the background.
+        """
+        if self._sequence is None:
+            raise ValueError("The simulation is not a sequence of snapshots.")
+        self.data = self._sequence.step(n)
+        self._reader = self._sequence.current
+
     def createShaders(self, parent):
         self._shaders.link()
 
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from .Reader import ParticleType, BLOCKS, NAMES, ORDER
+from .Reader import _check_subsample, _selection
+
+
+# datasets of the particle groups of the HDF5 files, by block label
+DATASETS = {
+    "POS ": "Coordinates",
+    "VEL ": "Velocities",
+    "ID  ": "ParticleIDs",
+    "MASS": "Masses",
+    "U   ": "InternalEnergy",
+    "RHO ": "Density",
+    "HSML": "SmoothingLength",
+    "POT ": "Potential",
+    "ACCE": "Acceleration",
+    "ENDT": "RateOfChangeOfEntropy",
+    "TSTP": "TimeStep",
+}
+
+
+def _header_property(name):
+    return property(lambda self: self._header[name])
+
+
+def _list_property(name):
+    return property(lambda self: [x.item() for x in self._header[name]])
+
+
+class GadgetHDF5(object):
+    """
+    A reader of the gadget snapshots in HDF5 (format 3), with the same
+    interface as GadgetReader: the blocks are read from the files the first
+    time they are accessed, by hyperslabs of the datasets.
+    """
+
+    def __init__(self, filename, numfile=1, threads=None):
+        """
+        A reader of the gadget snapshots in HDF5.
+
+        :params filename: the file of the snapshot, or the base name of the
+            files filename.0.hdf5, filename.1.hdf5... of a multi-file one.
+        :params numfile: the number of files of the snapshot.
+        :params threads: unused, HDF5 serializes the reads.
+        """
+        if h5py is None:
+            raise ImportError("h5py is needed to read HDF5 snapshots.")
+
+        self._filename = filename
+        self._nb_files = numfile
+        self._files = []
+        self._npart = []
+        self._header = {}
+        self._blocks = {}
+        self._particle_types = {}
+        self._types = None
+        self._subsample = None
+        self._seed = 0
+        self._downcast = True
+
+    def _filenames(self):
+        if self._nb_files == 1:
+            return [self._filename]
+        return [
+            "{0}.{1}.hdf5".format(self._filename, i)
+            for i in range(self._nb_files)
+        ]
+
+    def Read(self, types=None, subsample=None, seed=0, downcast=True,
+             **kwargs):
+        """
+        Open the files of the snapshot and read their headers, the blocks
+        being read the first time they are accessed. The types, subsample,
+        seed and downcast arguments are those of GadgetReader.Read, the
+        other ones (format, mmap...) are ignored.
+        """
+        self.close()
+        self._files = [h5py.File(name, "r") for name in self._filenames()]
+        self._header = dict(self._files[0]["Header"].attrs)
+        self._npart = [
+            [int(n) for n in f["Header"].attrs["NumPart_ThisFile"]]
+            for f in self._files
+        ]
+
+        self._types = None if types is None else set(types)
+        self._subsample = _check_subsample(subsample)
+        self._seed = seed
+        self._downcast = downcast
+        self._blocks = {}
+        self._particle_types = {}
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    filename = property(lambda self: self._filename)
+    time = _header_property("Time")
+    redshift = _header_property("Redshift")
+    BoxSize = _header_property("BoxSize")
+    num_files = _header_property("NumFilesPerSnapshot")
+    Omega0 = _header_property("Omega0")
+    OmegaLambda = _header_property("OmegaLambda")
+    HubbleParam = _header_property("HubbleParam")
+    flag_sfr = _header_property("Flag_Sfr")
+    flag_feedback = _header_property("Flag_Feedback")
+    flag_cooling = _header_property("Flag_Cooling")
+    flag_stellarage = _header_property("Flag_StellarAge")
+    flag_metals = _header_property("Flag_Metals")
+    npart = _list_property("NumPart_ThisFile")
+    npartTotal = _list_property("NumPart_Total")
+    npartTotalHighWord = _list_property("NumPart_Total_HighWord")
+    mass = _list_property("MassTable")
+
+    @property
+    def npart_total(self):
+        return [
+            low + (high << 32)
+            for low, high in zip(self.npartTotal, self.npartTotalHighWord)
+        ]
+
+    @property
+    def blocks(self):
+        if not self._files:
+            return []
+        return [
+            label for label in ORDER
+            if any(
+                DATASETS[label] in self._files[0][group]
+                for group in self._files[0]
+                if group.startswith("PartType")
+            )
+        ]
+
+    def _memory_dtype(self, dtype):
+        if self._downcast and dtype.kind == "f" and dtype.itemsize > 4:
+            return np.dtype(np.float32)
+        return dtype
+
+    def _sources(self, label, types=None):
+        """
+        The datasets of a block in every file for the given types, with the
+        index of their file and type and of their first particle in the
+        whole snapshot.
+        """
+        sources = []
+        start = 0
+        for index, f in enumerate(self._files):
+            for ptype in range(6):
+                group = "PartType{0}".format(ptype)
+                if (types is None or ptype in types) and group in f and \
+                        DATASETS[label] in f[group]:
+                    sources.append(
+                        (f[group][DATASETS[label]], index, ptype, start)
+                    )
+                start += self._npart[index][ptype]
+        return sources
+
+    def _read_types(self, label, types=None):
+        """
+        Read the particles of the given types of a block from every file into
+        one preallocated array, through hyperslabs of the datasets. Return
+        None if the block is not in the snapshot.
+        """
+        sources = self._sources(label, types)
+        if not sources:
+            return None
+
+        ncomp = BLOCKS[label][0]
+        dtype = self._memory_dtype(sources[0][0].dtype)
+        rows = []
+        for dataset, index, ptype, start in sources:
+            if self._subsample is None:
+                rows.append(None)
+            else:
+                rows.append(_selection(
+                    self._subsample, self._seed, index, start,
+                    dataset.shape[0], ptype,
+                ))
+
+        sizes = [
+            dataset.shape[0] if selection is None else selection.size
+            for (dataset, _, _, _), selection in zip(sources, rows)
+        ]
+        array = np.empty(sum(sizes) * ncomp, dtype=dtype)
+
+        begin = 0
+        for (dataset, _, _, _), selection, size in zip(sources, rows, sizes):
+            if size == 0:
+                continue
+            dest = array[begin:begin + size * ncomp].reshape(
+                (size,) + dataset.shape[1:]
+            )
+            if selection is None:
+                # HDF5 converts the type while reading
+                dataset.read_direct(dest)
+            else:
+                dest[...] = dataset[selection]
+            begin += size * ncomp
+        return array
+
+    def iter_chunks(self, block="POS ", chunk_particles=1048576, ids=False):
+        """
+        Iterate over a block by chunks of chunk_particles particles, as
+        GadgetReader.iter_chunks, reading hyperslabs of the datasets into
+        the same buffers.
+        """
+        label = NAMES.get(block, block)
+        sources = self._sources(label, self._types)
+        if not sources:
+            raise KeyError(
+                "No block '{0}' in {1}.".format(label, self._filename)
+            )
+
+        ncomp = BLOCKS[label][0]
+        datasets = [[source[0] for source in sources]]
+        buffers = [np.empty(
+            chunk_particles * ncomp,
+            dtype=self._memory_dtype(sources[0][0].dtype),
+        )]
+        if ids:
+            datasets.append([
+                self._files[index]["PartType{0}".format(ptype)]["ParticleIDs"]
+                for _, index, ptype, _ in sources
+            ])
+            buffers.append(
+                np.empty(chunk_particles, dtype=datasets[1][0].dtype)
+            )
+
+        widths = [ncomp, 1]
+        filled = 0
+        for position in range(len(sources)):
+            nb = sources[position][0].shape[0]
+            first = 0
+            while first < nb:
+                count = min(nb - first, chunk_particles - filled)
+                for dataset, buffer, width in zip(datasets, buffers, widths):
+                    dataset = dataset[position]
+                    dest = buffer[filled * width:(filled + count) * width]
+                    dataset.read_direct(
+                        dest.reshape((count,) + dataset.shape[1:]),
+                        np.s_[first:first + count],
+                    )
+                first += count
+                filled += count
+                if filled == chunk_particles:
+                    yield self._chunk(buffers, widths, filled, ids)
+                    filled = 0
+        if filled:
+            yield self._chunk(buffers, widths, filled, ids)
+
+    def _chunk(self, buffers, widths, filled, ids):
+        arrays = [
+            buffer[:filled * width] for buffer, width in zip(buffers, widths)
+        ]
+        return tuple(arrays) if ids else arrays[0]
+
+    def block(self, label):
+        label = NAMES.get(label, label)
+        if label not in BLOCKS:
+            raise KeyError("Unknown block '{0}'.".format(label))
+        if label not in self._blocks:
+            array = self._read_types(label, self._types)
+            if array is None:
+                raise KeyError(
+                    "No block '{0}' in {1}.".format(label, self._filename)
+                )
+            self._blocks[label] = array
+        return self._blocks[label]
+
+    def drop(self, label):
+        self._blocks.pop(NAMES.get(label, label), None)
+
+    def type(self, ptype):
+        if ptype not in self._particle_types:
+            self._particle_types[ptype] = ParticleType(self, ptype)
+        return self._particle_types[ptype]
+
+    @property
+    def positions(self):
+        return self.block("POS ")
+
+    @property
+    def velocities(self):
+        return self.block("VEL ")
+
+    @property
+    def ids(self):
+        return self.block("ID  ")
+
+    @property
+    def masses(self):
+        return self.block("MASS")
+
+    @property
+    def internal_energy(self):
+        return self.block("U   ")
+
+    @property
+    def density(self):
+        return self.block("RHO ")
+
+    @property
+    def smoothing_length(self):
+        return self.block("HSML")
+
+# vim: set tw=79 :
@@ -28,13 +28,25 @@ cdef class GadgetReader:
     cdef Header _header
     cdef _filename
     cdef _nb_files
-    cdef _pos
-    cdef _vel
+    cdef _blocks
+    cdef _mmap
+    cdef _types
+    cdef _subsample
+    cdef _seed
+    cdef _downcast
+    cdef _particle_types
+    cdef _layout
+    cdef _threads
     #cpdef Write
     #cpdef Read
-    cdef _read_block(self, void *var, int size, int nb, FILE *fd)
-    cpdef int _write_format1(self)
-    cpdef int _write_format2(self)
-    cpdef _read_format1(self, bint bpot=?, bint bacc=?, bint bdadt=?, bint bdt=?)
-    #cpdef _read_format2(self, int num_files, bint bpot=?, bint bacc=?, bint bdadt=?, bint bdt=?)
+    cdef int _detect_swap(self, FILE *fd, int first, filename) except -1
+    cdef _skip_record(self, FILE *fd, label, filename, bint swap=?, long long nb=?)
+    cdef _scan_format1(self, filename, bint bpot=?, bint bacc=?, bint bdadt=?, bint bdt=?, bint keep_header=?)
+    cdef _scan_format2(self, filename, bint keep_header=?)
+    cdef _read_block(self, void *var, int size, int nb, FILE *fd, bint swap=?)
+    cdef bytes _header_bytes(self, npart, total, int num_files)
+    cpdef int _write_format1(self, filename=?, int num_files=?, blocks=?) except -1
+    cpdef int _write_format2(self, filename=?, int num_files=?, blocks=?) except -1
+    cpdef _read_format1(self, bint bpot=?, bint bacc=?, bint bdadt=?, bint bdt=?, bint mmap=?)
+    cpdef _read_format2(self, bint bpot=?, bint bacc=?, bint bdadt=?, bint bdt=?, bint mmap=?)
 
@@ -4,21 +4,456 @@ cimport Reader as g
 import numpy as np
 cimport numpy as np
 
+import os
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor
+
 from libc.stdlib cimport malloc, calloc, free
 from libc.stdio  cimport fread, fwrite, FILE, fopen, fclose, stderr, fprintf
+from libc.stdio  cimport SEEK_SET, SEEK_CUR
+from posix.stdio cimport fseeko, ftello
+from posix.types cimport off_t
 
 #class ReadError():
     #pass
 
+# Blocks of a gadget snapshot, label -> (number of components, kind of the
+# elements as a numpy type character).
+BLOCKS = {
+    "POS ": (3, "f"),
+    "VEL ": (3, "f"),
+    "ID  ": (1, "u"),
+    "MASS": (1, "f"),
+    "U   ": (1, "f"),
+    "RHO ": (1, "f"),
+    "HSML": (1, "f"),
+    "POT ": (1, "f"),
+    "ACCE": (3, "f"),
+    "ENDT": (1, "f"),
+    "TSTP": (1, "f"),
+}
+
+# order of the blocks in a file
+ORDER = (
+    "POS ", "VEL ", "ID  ", "MASS", "U   ", "RHO ", "HSML", "POT ", "ACCE",
+    "ENDT", "TSTP",
+)
+
+# name of the properties giving access to the blocks
+NAMES = {
+    "positions": "POS ",
+    "velocities": "VEL ",
+    "ids": "ID  ",
+    "masses": "MASS",
+    "internal_energy": "U   ",
+    "density": "RHO ",
+    "smoothing_length": "HSML",
+}
+
+# blocks only stored for the gas particles
+GAS_BLOCKS = ("U   ", "RHO ", "HSML", "ENDT")
+
+
+def _block_npart(label, npart, mass):
+    """
+    Number of particles of each type stored in the block.
+    """
+    if label in GAS_BLOCKS:
+        return [npart[0], 0, 0, 0, 0, 0]
+    if label == "MASS":
+        return [n if m == 0 else 0 for n, m in zip(npart, mass)]
+    return list(npart)
+
+
+def _block_size(label, npart, mass):
+    """
+    The number of elements of a block, 0 if the block is unknown.
+    """
+    if label not in BLOCKS:
+        return 0
+    return sum(_block_npart(label, npart, mass)) * BLOCKS[label][0]
+
+
+def _format1_labels(npart, mass, bpot=False, bacc=False, bdadt=False,
+                    bdt=False):
+    """
+    The labels of the blocks of a format 1 file, in the order they are
+    written since the format 1 has no label in the file.
+    """
+    labels = ["POS ", "VEL ", "ID  "]
+    if sum(_block_npart("MASS", npart, mass)) > 0:
+        labels.append("MASS")
+    if npart[0] > 0:
+        labels += ["U   ", "RHO ", "HSML"]
+    if bpot:
+        labels.append("POT ")
+    if bacc:
+        labels.append("ACCE")
+    if bdadt and npart[0] > 0:
+        labels.append("ENDT")
+    if bdt:
+        labels.append("TSTP")
+    return labels
+
+
+def _check_format1_order(labels, npart, mass):
+    """
+    Without labels, a format 1 file can only be read back if none of the
+    standard blocks before the last one written is missing.
+    """
+    standard = _format1_labels(npart, mass)
+    written  = [label for label in labels if label in standard]
+    if written != standard[:len(written)]:
+        raise ValueError(
+            "The blocks {0} must be written in the format 1.".format(
+                standard[:standard.index(written[-1]) + 1]
+            )
+        )
+
+
+def _split_npart(npart, num_files):
+    """
+    The number of particles of each type in each of num_files files.
+    """
+    return [
+        [n // num_files + (f < n % num_files) for n in npart]
+        for f in range(num_files)
+    ]
+
+
+def _block_dtype(layout, label):
+    """
+    The numpy type of the elements of a block of a file, its width being
+    given by the size of the record.
+    """
+    ncomp, kind = BLOCKS[label]
+    size = layout["blocks"][label][1]
+    nb   = sum(_block_npart(label, layout["npart"], layout["mass"]))
+    return np.dtype("{0}{1}".format(kind, size // (ncomp * nb)))
+
+
+def _type_ranges(layout, label, types=None):
+    """
+    The (offset, size) in bytes in the file of the particles of the given
+    types in a block. The particles of a block are sorted by type, so the
+    ranges of adjacent types are merged.
+    """
+    offset, size = layout["blocks"][label]
+    if types is None:
+        return [(offset, size)]
+
+    npart  = _block_npart(label, layout["npart"], layout["mass"])
+    width  = size // sum(npart)
+    ranges = []
+    for i in range(6):
+        nbytes = npart[i] * width
+        if i in types and nbytes > 0:
+            if ranges and sum(ranges[-1]) == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + nbytes)
+            else:
+                ranges.append((offset, nbytes))
+        offset += nbytes
+    return ranges
+
+
+def _memmap_block(layout, label, types=None):
+    """
+    A read-only memory mapped view of a block of a file, flattened as the
+    arrays read in memory. The view of a file of the opposite byte order has
+    a non-native type. Non adjacent types can't be viewed at once, so their
+    selection is copied.
+    """
+    dtype = _block_dtype(layout, label)
+    if layout["swap"]:
+        dtype = dtype.newbyteorder()
+    views = [
+        np.memmap(
+            layout["filename"],
+            dtype=dtype,
+            mode="r",
+            offset=offset,
+            shape=(size // dtype.itemsize,),
+        )
+        for offset, size in _type_ranges(layout, label, types)
+    ]
+    if not views:
+        return np.empty(0, dtype=dtype)
+    if len(views) == 1:
+        return views[0]
+    return np.concatenate(views)
+
+
+def _read_cast(filename, offset, size, dest, dtype, swap=False,
+               chunk=16777216):
+    """
+    Read size bytes of elements of type dtype at the offset of the file into
+    dest, an array of another type, through a buffer of chunk bytes so that
+    no full-size temporary is needed.
+    """
+    buffer = np.empty(
+        max(min(chunk, size) // dtype.itemsize, 1), dtype=dtype
+    )
+    raw    = buffer.view(np.uint8)
+    start  = 0
+    while size > 0:
+        nbytes = min(size, buffer.nbytes)
+        _read_into(filename, offset, raw[:nbytes])
+        part = buffer[:nbytes // dtype.itemsize]
+        if swap:
+            part.byteswap(inplace=True)
+        dest[start:start + part.size] = part
+        start  += part.size
+        offset += nbytes
+        size   -= nbytes
+
+
+cdef int _write_records(filename, records, int format) except -1:
+    """
+    Write a file made of records (label, size, pieces): the size in bytes of
+    the data, then the arrays of pieces, any iterable over contiguous arrays
+    of native byte order. In the format 2, each record is preceded by the
+    record of its label. As with gadget, the markers of a record larger than
+    4 GB wrap around.
+
+    The file is written aside then moved over filename, so the pieces may be
+    memory mapped from the file they replace.
+    """
+    cdef:
+        bytes fname
+        FILE *fd = NULL
+        int closed
+
+    tmp   = "{0}.{1}.tmp".format(filename, os.getpid())
+    fname = tmp.encode()
+    fd    = fopen(fname, "wb")
+    if fd is NULL:
+        raise IOError("Can't open {0} for writing.".format(filename))
+
+    try:
+        _write_data(fd, filename, records, format)
+    except:
+        fclose(fd)
+        os.remove(tmp)
+        raise
+    closed = fclose(fd)
+    if closed != 0:
+        os.remove(tmp)
+        raise IOError("Error while writing {0}.".format(filename))
+    os.replace(tmp, filename)
+
+    return 0
+
+
+cdef int _write_data(FILE *fd, filename, records, int format) except -1:
+    """
+    Write the records to an open file.
+    """
+    cdef:
+        int eight = 8
+        unsigned int size, nextblock
+        size_t nbytes, written, total
+        char *buf
+        char *name
+        np.ndarray piece
+
+    for label, nb, pieces in records:
+        size = nb & 0xffffffff
+
+        if format == 2:
+            nextblock = (nb + 8) & 0xffffffff
+            blabel = label.encode("ascii")
+            name = blabel
+            fwrite(&eight, sizeof(eight), 1, fd)
+            fwrite(name, 1, 4, fd)
+            fwrite(&nextblock, sizeof(nextblock), 1, fd)
+            fwrite(&eight, sizeof(eight), 1, fd)
+
+        fwrite(&size, sizeof(size), 1, fd)
+        total = 0
+        for array in pieces:
+            piece = np.ascontiguousarray(
+                array, dtype=array.dtype.newbyteorder("=")
+            )
+            buf    = <char*>piece.data
+            nbytes = piece.nbytes
+            with nogil:
+                written = fwrite(buf, 1, nbytes, fd)
+            if written != nbytes:
+                raise IOError("Error while writing {0}.".format(filename))
+            total += nbytes
+        if total != nb:
+            raise IOError(
+                "{0} bytes given for the block '{1}' instead of {2}.".format(
+                    total, label, nb
+                )
+            )
+        fwrite(&size, sizeof(size), 1, fd)
+
+    return 0
+
+
+cdef void _swap_bytes(void *data, size_t width, size_t nb) nogil:
+    """
+    Reverse the bytes of nb elements of width bytes.
+    """
+    cdef:
+        unsigned char *p = <unsigned char*>data
+        unsigned char tmp
+        size_t i, j
+
+    for i in range(nb):
+        for j in range(width // 2):
+            tmp = p[i * width + j]
+            p[i * width + j] = p[(i + 1) * width - 1 - j]
+            p[(i + 1) * width - 1 - j] = tmp
+
+
+cdef void _swap_header(Header *header) nogil:
+    """
+    Swap the byte order of the fields of a header.
+    """
+    _swap_bytes(header.npart, sizeof(int), 6)
+    _swap_bytes(header.mass, sizeof(double), 6)
+    _swap_bytes(&header.time, sizeof(double), 1)
+    _swap_bytes(&header.redshift, sizeof(double), 1)
+    _swap_bytes(&header.flag_sfr, sizeof(int), 1)
+    _swap_bytes(&header.flag_feedback, sizeof(int), 1)
+    _swap_bytes(header.npartTotal, sizeof(unsigned int), 6)
+    _swap_bytes(&header.flag_cooling, sizeof(int), 1)
+    _swap_bytes(&header.num_files, sizeof(int), 1)
+    _swap_bytes(&header.BoxSize, sizeof(double), 1)
+    _swap_bytes(&header.Omega0, sizeof(double), 1)
+    _swap_bytes(&header.OmegaLambda, sizeof(double), 1)
+    _swap_bytes(&header.HubbleParam, sizeof(double), 1)
+    _swap_bytes(&header.flag_stellarage, sizeof(int), 1)
+    _swap_bytes(&header.flag_metals, sizeof(int), 1)
+    _swap_bytes(header.npartTotalHighWord, sizeof(unsigned int), 6)
+    _swap_bytes(&header.flag_entropy_instead_u, sizeof(int), 1)
+
+
+def _check_subsample(subsample):
+    """
+    Check a subsampling: None, a positive stride or a fraction in ]0, 1].
+    """
+    if subsample is None:
+        return None
+    if isinstance(subsample, float):
+        if not 0. < subsample <= 1.:
+            raise ValueError("A subsampling fraction must be in ]0, 1].")
+        return subsample
+    if int(subsample) < 1:
+        raise ValueError("A subsampling stride must be positive.")
+    return int(subsample)
+
+
+def _selection(subsample, seed, index, start, nb, ptype):
+    """
+    The indices of the nb particles of a type in the file index kept by the
+    subsampling, start being the index of the first one in the whole
+    snapshot: one every subsample if an integer, else a random fraction
+    drawn from the seed. The selection is the same for every block.
+    """
+    if isinstance(subsample, float):
+        # the gaps between selected particles of a Bernoulli selection are
+        # geometric, so only the selected indices are drawn
+        rng    = np.random.default_rng([seed, index, ptype])
+        size   = int(nb * subsample * 1.1) + 16
+        chunks = []
+        last   = -1
+        while last < nb:
+            gaps = rng.geometric(subsample, size)
+            chunks.append(np.cumsum(gaps) + last)
+            last = chunks[-1][-1]
+        rows = np.concatenate(chunks)
+        return rows[rows < nb]
+    return np.arange((-start) % subsample, nb, subsample)
+
+
+def _take(pieces, begin, end):
+    """
+    The views of the elements [begin, end[ of the concatenation of pieces.
+    """
+    views = []
+    for piece in pieces:
+        if begin < piece.size and end > 0:
+            views.append(piece[max(begin, 0):min(end, piece.size)])
+        begin -= piece.size
+        end   -= piece.size
+    return views
+
+
+def _chunk_plan(ranges, width, chunk_particles):
+    """
+    Split the (filename, offset, size) ranges of a block into chunks of
+    chunk_particles particles of width bytes, yielding for each chunk the
+    list of ranges to read.
+    """
+    chunk = []
+    free  = chunk_particles * width
+    for filename, offset, size in ranges:
+        while size > 0:
+            nbytes = min(size, free)
+            chunk.append((filename, offset, nbytes))
+            offset += nbytes
+            size   -= nbytes
+            free   -= nbytes
+            if free == 0:
+                yield chunk
+                chunk = []
+                free  = chunk_particles * width
+    if chunk:
+        yield chunk
+
+
+def _read_into(filename, off_t offset, np.ndarray dest):
+    """
+    Read the bytes of the file at the offset into the contiguous array
+    dest, releasing the GIL around the I/O.
+    """
+    cdef:
+        bytes fname  = filename.encode()
+        char *cname  = fname
+        char *buf    = <char*>dest.data
+        size_t nbytes = dest.nbytes
+        size_t nread = 0
+        FILE *fd     = NULL
+
+    with nogil:
+        fd = fopen(cname, "rb")
+        if fd is not NULL:
+            if fseeko(fd, offset, SEEK_SET) == 0:
+                nread = fread(buf, 1, nbytes, fd)
+            fclose(fd)
+
+    if fd is NULL:
+        raise FileNotFoundError(filename)
+    if nread != nbytes:
+        raise IOError(
+            "Read {0} bytes instead of {1} in {2}.".format(
+                nread, nbytes, filename
+            )
+        )
+
+
 cdef class GadgetReader:
     def __cinit__(self, *args, **kwargs):
         pass
 
     @cython.boundscheck(False)
-    def __init__(self, filename, numfile=1):
+    def __init__(self, filename, numfile=1, threads=None):
         cdef unsigned int i
         self._filename  = filename
         self._nb_files = numfile
+        self._threads  = threads
+        self._layout   = []
+        self._blocks   = {}
+        self._mmap     = False
+        self._types    = None
+        self._subsample = None
+        self._seed     = 0
+        self._downcast = True
+        self._particle_types = {}
 
         for i in range(6):
             self._header.npart[i]              = 0
@@ -59,7 +494,7 @@ Simulation flags:
     flag_stellarage        : {13}
     flag_metals            : {14}
     flag_entropy_instead_u : {15}
-The only gadget file format supported is the gadget 1.
+The supported gadget file formats are the formats 1 and 2.
             """.format(
                 self.filename,
                 self.header.time,
@@ -86,29 +521,184 @@ The only gadget file format supported is the gadget 1.
         #free(self.part_pos)
         #free(self.part_vel)
 
-    cpdef int _write_format1(self):
-        cdef int res
-        cdef unsigned int i
-        cdef char *fname = self.filename
-        #if self.part.ptr_data == NULL:
-            #raise MemoryError("Particules array not allocate.")
-        for i in range(6):
-            self.header.npartTotal[i] = self.header.npart[i]
-        #res = g.Double_Gadget_Write_format1(fname, self.header, self.part.ptr_data)
-        return res
+    cpdef int _write_format1(self, filename=None, int num_files=1, blocks=None) except -1:
+        self._write(filename, num_files, blocks, 1)
+        return 0
+
+    cpdef int _write_format2(self, filename=None, int num_files=1, blocks=None) except -1:
+        self._write(filename, num_files, blocks, 2)
+        return 0
+
+    cdef bytes _header_bytes(self, npart, total, int num_files):
+        """
+        The bytes of the header of a file holding npart particles of a
+        snapshot of total particles split in num_files files.
+        """
+        cdef:
+            Header header = self._header
+            unsigned int i
 
-    cpdef int _write_format2(self):
-        cdef int res
-        cdef unsigned int i
-        cdef char *fname = self.filename
-        #if self.part.ptr_data == NULL:
-            #raise MemoryError("Particules array not allocate.")
         for i in range(6):
-            self.header.npartTotal[i] = self.header.npart[i]
-        #res = g.Double_Gadget_Write_format2(fname, self.header, self.part.ptr_data)
-        return res
+            header.npart[i]              = npart[i]
+            header.npartTotal[i]         = total[i] & 0xffffffff
+            header.npartTotalHighWord[i] = total[i] >> 32
+        header.num_files = num_files
+
+        return (<char*>&header)[:sizeof(Header)]
+
+    def _write_labels(self, blocks=None):
+        """
+        The labels of the blocks to write, in the order of the format 1: the
+        given ones, else every block in memory or in the read snapshot.
+        """
+        if blocks is None:
+            blocks = set(self._blocks)
+            for layout in self._layout:
+                blocks.update(l for l in layout["blocks"] if l in BLOCKS)
+        blocks = [NAMES.get(label, label) for label in blocks]
+        return [label for label in ORDER if label in blocks]
 
-    cdef _read_block(self, void *var, int size, int nb, FILE *fd):
+    def _memory_segments(self):
+        """
+        The runs of particles of the blocks in memory, in their order, as
+        (layout of the file or None, type, number of particles). The blocks
+        read from a snapshot hold, file by file, the particles of the
+        selected types kept by the subsampling; the blocks of a snapshot
+        built in memory the particles given by npart.
+        """
+        if not self._layout:
+            return [(None, i, n) for i, n in enumerate(self.npart)]
+
+        segments = []
+        start    = 0
+        for index, l in enumerate(self._layout):
+            for i in range(6):
+                nb = l["npart"][i]
+                if self._types is None or i in self._types:
+                    if self._subsample is not None:
+                        nb = len(_selection(
+                            self._subsample, self._seed, index, start, nb, i,
+                        ))
+                    segments.append((l, i, nb))
+                start += l["npart"][i]
+        return segments
+
+    def _write(self, filename, num_files, blocks, format):
+        """
+        Write the header and the blocks, split in num_files files. The data
+        are written straight from the arrays of the blocks. The particles
+        are those in memory: after a reading, the ones of every file of the
+        selected types kept by the subsampling, else the ones of npart.
+        """
+        filename = self._filename if filename is None else filename
+        mass     = self.mass
+        labels   = self._write_labels(blocks)
+        segments = self._memory_segments()
+
+        npart = [0] * 6
+        for _, i, nb in segments:
+            npart[i] += nb
+        # the blocks of types without particles, as the gas ones
+        labels = [
+            label for label in labels
+            if label in ("POS ", "VEL ", "ID  ") or
+            _block_size(label, npart, mass) > 0
+        ]
+        if format == 1:
+            _check_format1_order(labels, npart, mass)
+
+        # the pieces of each block by type, in the order of the files
+        typed = {}
+        for label in labels:
+            array = self.block(label)
+            array = np.ascontiguousarray(
+                array, dtype=array.dtype.newbyteorder("=")
+            ).ravel()
+            ncomp = BLOCKS[label][0]
+            typed[label] = [[] for i in range(6)]
+            start = 0
+            for l, i, nb in segments:
+                if l is not None and label not in l["blocks"]:
+                    continue
+                if _block_npart(label, [1] * 6, mass)[i] == 0:
+                    continue
+                typed[label][i].append(
+                    array[start * ncomp:(start + nb) * ncomp]
+                )
+                start += nb
+            if array.size != start * ncomp:
+                raise ValueError(
+                    "The block '{0}' has {1} elements instead of {2}, ".format(
+                        label, array.size, start * ncomp
+                    ) + "npart must give the number of particles to write."
+                )
+
+        per_file = _split_npart(npart, num_files)
+        for f, file_npart in enumerate(per_file):
+            # index of the first particle of each type of the file
+            first = [sum(n[i] for n in per_file[:f]) for i in range(6)]
+
+            records = [(
+                "HEAD",
+                sizeof(Header),
+                [np.frombuffer(
+                    self._header_bytes(file_npart, npart, num_files),
+                    dtype=np.uint8,
+                )],
+            )]
+            for label in labels:
+                ncomp  = BLOCKS[label][0]
+                pieces = []
+                for i in range(6):
+                    pieces += _take(
+                        typed[label][i],
+                        first[i] * ncomp,
+                        (first[i] + file_npart[i]) * ncomp,
+                    )
+                records.append(
+                    (label, sum(piece.nbytes for piece in pieces), pieces)
+                )
+
+            if num_files == 1:
+                name = filename
+            else:
+                name = "{0}.{1}".format(filename, f)
+            _write_records(name, records, format)
+
+    def write_chunks(self, filename, chunks, format=1):
+        """
+        Write a single file snapshot whose blocks are given by chunks, a
+        dictionary label -> iterator over arrays, which are written as they
+        come. npart must give the number of particles of the snapshot, so
+        that the sizes of the records are known before the data.
+        """
+        npart  = self.npart
+        mass   = self.mass
+        chunks = {NAMES.get(label, label): it for label, it in chunks.items()}
+        labels = self._write_labels(chunks)
+        if format == 1:
+            _check_format1_order(labels, npart, mass)
+
+        records = [(
+            "HEAD",
+            sizeof(Header),
+            [np.frombuffer(
+                self._header_bytes(npart, npart, 1), dtype=np.uint8
+            )],
+        )]
+        for label in labels:
+            it = iter(chunks[label])
+            first = next(it, None)
+            if first is None:
+                raise ValueError("No data for the block '{0}'.".format(label))
+            nb = _block_size(label, npart, mass)
+            records.append(
+                (label, nb * first.itemsize, itertools.chain([first], it))
+            )
+
+        _write_records(filename, records, format)
+
+    cdef _read_block(self, void *var, int size, int nb, FILE *fd, bint swap=0):
         cdef:
             int dummy, dummy2
 
@@ -117,86 +707,475 @@ The only gadget file format supported is the gadget 1.
         fread(&dummy2, sizeof(dummy), 1, fd)
 
         if dummy != dummy2:
-            raise MemoryError #ReadError("Bad reading while reading header.")
+            raise IOError("Bad record markers while reading a block.")
+
+        if swap:
+            _swap_bytes(var, size, nb)
+
+    cdef int _detect_swap(self, FILE *fd, int first, filename) except -1:
+        """
+        Tell from the first record marker of the file, which must be equal
+        to first, whether the file has the opposite byte order.
+        """
+        cdef int dummy
+
+        if fread(&dummy, sizeof(dummy), 1, fd) != 1:
+            raise IOError("{0} is empty.".format(filename))
+        fseeko(fd, 0, SEEK_SET)
+
+        if dummy == first:
+            return 0
+        _swap_bytes(&dummy, sizeof(dummy), 1)
+        if dummy == first:
+            return 1
+        raise IOError("{0} is not a gadget file.".format(filename))
+
+    cdef _skip_record(self, FILE *fd, label, filename, bint swap=0, long long nb=0):
+        """
+        Skip the Fortran record at the current position of the file and
+        return the offset and size of its data, or None at the end of file.
+        The 32 bits markers of a record larger than 4 GB have wrapped
+        around, so its size is the one of nb elements, if known, of 4 or 8
+        bytes matching the markers.
+        """
+        cdef:
+            unsigned int dummy, dummy2
+            off_t offset, size
+
+        if fread(&dummy, sizeof(dummy), 1, fd) != 1:
+            return None
+        if swap:
+            _swap_bytes(&dummy, sizeof(dummy), 1)
+
+        size = dummy
+        for width in (4, 8):
+            if nb > 0 and (nb * width) & 0xffffffff == dummy:
+                size = nb * width
+                break
+
+        offset = ftello(fd)
+        fseeko(fd, size, SEEK_CUR)
+        if fread(&dummy2, sizeof(dummy2), 1, fd) != 1:
+            raise IOError(
+                "Truncated block '{0}' in {1}.".format(label, filename)
+            )
+        if swap:
+            _swap_bytes(&dummy2, sizeof(dummy2), 1)
+        if dummy != dummy2:
+            raise IOError(
+                "Bad record markers for block '{0}' in {1}.".format(
+                    label, filename
+                )
+            )
+        return offset, size
 
-    cpdef _read_format1(self, bint bpot=0, bint bacc=0, bint bdadt=0, bint bdt=0):
+    cdef _scan_format1(self, filename, bint bpot=0, bint bacc=0, bint bdadt=0, bint bdt=0, bint keep_header=0):
+        """
+        Walk once the Fortran record markers of a file in format 1 and
+        return its header with a table label -> (offset, size) of its blocks.
+        """
         cdef:
             FILE *fd = NULL
-            int N = 0
-            int dummy, dummy2
-            int i, j, k, ntot_withmasses = 0
-            int n, pc, pc_new, pc_sph
-            int NumPart = 0
-            char *fname
-            np.ndarray[float, ndim=1, mode="c"] _pos, _vel
-
-        for i in range(self._nb_files):
-            if self.num_files != 1:
-                filename = self._filename + ".%d"%i
-                fname    = filename
-            else:
-                fname    = self._filename
+            Header header
+            bint swap = 0
+            bytes fname = filename.encode()
 
-            fd = fopen(fname, "r")
-            if fd is NULL:
-                raise FileNotFoundError(filename)
-            fprintf(stderr, "File open")
+        fd = fopen(fname, "rb")
+        if fd is NULL:
+            raise FileNotFoundError(filename)
 
-            self._read_block(&self._header, sizeof(self._header), 1, fd)
-            fprintf(stderr, "Bloc lu.")
+        try:
+            swap = self._detect_swap(fd, sizeof(header), filename)
+            self._read_block(&header, sizeof(header), 1, fd)
+            if swap:
+                _swap_header(&header)
+            npart = [header.npart[i] for i in range(6)]
+            mass  = [header.mass[i] for i in range(6)]
 
-            if self._nb_files == 1:
-                for j in range(6):
-                    NumPart += self._header.npart[j]
-            else:
-                for j in range(6):
-                    NumPart += self._header.npartTotal[j]
+            blocks = {}
+            for label in _format1_labels(npart, mass, bpot, bacc, bdadt, bdt):
+                record = self._skip_record(
+                    fd, label, filename, swap, _block_size(label, npart, mass)
+                )
+                if record is None:
+                    break
+                blocks[label] = record
+        finally:
+            fclose(fd)
 
-            for j in range(6):
-                if self._header.mass[j] == 0:
-                    ntot_withmasses += self._header.npart[j]
+        if keep_header:
+            self._header = header
 
-            if i == 0:
-                fprintf(stderr, "Begin init")
-                _pos = np.empty(3*NumPart, dtype=np.float32)
-                fprintf(stderr, "Toto")
-                _vel = np.empty(3*NumPart, dtype=np.float32)
-                fprintf(stderr, "End init")
+        return {
+            "filename": filename,
+            "npart": npart,
+            "mass": mass,
+            "swap": swap,
+            "blocks": blocks,
+        }
+
+    cdef _scan_format2(self, filename, bint keep_header=0):
+        """
+        Walk once the labels of the blocks of a file in format 2 and return
+        its header with a table label -> (offset, size) of its blocks.
+        """
+        cdef:
+            FILE *fd = NULL
+            Header header
+            int dummy, dummy2, nextblock
+            char name[4]
+            bint has_header = 0
+            bint swap = 0
+            bytes fname = filename.encode()
 
-            self._read_block(<float*>_pos.data, sizeof(float), 3*NumPart, fd)
-            self._read_block(<float*>_vel.data, sizeof(float), 3*NumPart, fd)
+        fd = fopen(fname, "rb")
+        if fd is NULL:
+            raise FileNotFoundError(filename)
 
+        try:
+            swap   = self._detect_swap(fd, 8, filename)
+            blocks = {}
+            while fread(&dummy, sizeof(dummy), 1, fd) == 1:
+                fread(name, 1, 4, fd)
+                fread(&nextblock, sizeof(nextblock), 1, fd)
+                if fread(&dummy2, sizeof(dummy2), 1, fd) != 1:
+                    raise IOError(
+                        "Truncated block label in {0}.".format(filename)
+                    )
+                if swap:
+                    _swap_bytes(&dummy, sizeof(dummy), 1)
+                    _swap_bytes(&dummy2, sizeof(dummy2), 1)
+                if dummy != 8 or dummy2 != 8:
+                    raise IOError(
+                        "Bad block label record in {0}.".format(filename)
+                    )
+                label = name[:4].decode("ascii")
+
+                if label == "HEAD":
+                    self._read_block(&header, sizeof(header), 1, fd)
+                    if swap:
+                        _swap_header(&header)
+                    npart = [header.npart[i] for i in range(6)]
+                    mass  = [header.mass[i] for i in range(6)]
+                    has_header = 1
+                    continue
+
+                record = self._skip_record(
+                    fd, label, filename, swap,
+                    _block_size(label, npart, mass) if has_header else 0,
+                )
+                if record is None:
+                    break
+                blocks[label] = record
+        finally:
             fclose(fd)
 
-        self._pos = _pos
-        self._vel = _vel
+        if not has_header:
+            raise IOError("No header block in {0}.".format(filename))
+
+        if keep_header:
+            self._header = header
+
+        return {
+            "filename": filename,
+            "npart": npart,
+            "mass": mass,
+            "swap": swap,
+            "blocks": blocks,
+        }
+
+    cpdef _read_format1(self, bint bpot=0, bint bacc=0, bint bdadt=0, bint bdt=0, bint mmap=0):
+        self._layout = [
+            self._scan_format1(filename, bpot, bacc, bdadt, bdt, i == 0)
+            for i, filename in enumerate(self._filenames())
+        ]
+        self._load(mmap)
+
+    cpdef _read_format2(self, bint bpot=0, bint bacc=0, bint bdadt=0, bint bdt=0, bint mmap=0):
+        # the blocks are labelled in the format 2, the flags are not needed
+        self._layout = [
+            self._scan_format2(filename, i == 0)
+            for i, filename in enumerate(self._filenames())
+        ]
+        self._load(mmap)
+
+    def _load(self, mmap=False):
+        """
+        Forget the blocks of a previous reading. They are read (or mapped
+        in memory) from the scanned files the first time they are accessed.
+        """
+        if mmap and len(self._layout) != 1:
+            raise ValueError(
+                "Memory mapping is only supported for single file snapshots."
+            )
+        if len(set(l["swap"] for l in self._layout)) > 1:
+            raise IOError(
+                "The files of {0} have different byte orders.".format(
+                    self._filename
+                )
+            )
+        self._mmap   = mmap
+        self._blocks = {}
+        self._particle_types = {}
+
+    def _load_blocks(self, labels, types=None):
+        """
+        Read the blocks from every file of the snapshot into one preallocated
+        array per block, keeping only the particles of the given types. The
+        offset of each file into the arrays is known from the headers, so
+        the files are read concurrently by a pool of threads. The double
+        precision blocks are downcast while read if asked.
+        """
+        arrays  = {}
+        tasks   = []
+        swapped = []
+        for label in labels:
+            layouts = [l for l in self._layout if label in l["blocks"]]
+            if not layouts:
+                continue
+
+            ranges = self._ranges(label, types)
+            dtype  = _block_dtype(layouts[0], label)
+            cast   = self._memory_dtype(dtype)
+            nbytes = sum(size for _, _, size in ranges)
+            arrays[label] = np.empty(nbytes // dtype.itemsize, dtype=cast)
 
-    #cpdef _read_format2(self, bint bpot=0, bint bacc=0, bint bdadt=0, bint bdt=0):
-        #cdef int N = 0
-        #cdef unsigned int i
-        #cdef char *fname = <bytes>self.filename.encode()
-        #cdef Types.Particule_d part
+            if cast != dtype:
+                # converted by chunks, without a full-size temporary
+                start = 0
+                for filename, offset, size in ranges:
+                    end = start + size // dtype.itemsize
+                    tasks.append((
+                        _read_cast, filename, offset, size,
+                        arrays[label][start:end], dtype, layouts[0]["swap"],
+                    ))
+                    start = end
+                continue
 
-        ##part = g.Double_Gadget_Read_format2(fname, &self.header, num_files, bpot, bacc, bdadt, bdt)
-        #if part is NULL:
-            #raise MemoryError
+            raw   = arrays[label].view(np.uint8)
+            start = 0
+            for filename, offset, size in ranges:
+                tasks.append((_read_into, filename, offset, raw[start:start + size]))
+                start += size
+            if layouts[0]["swap"]:
+                swapped.append(arrays[label])
 
-        #for i in range(6):
-            #N += self.header.npart[i]
+        with ThreadPoolExecutor(self._threads) as pool:
+            list(pool.map(lambda task: task[0](*task[1:]), tasks))
 
-        #self.part = Types.FromPointer(part, N)
+        for array in swapped:
+            array.byteswap(inplace=True)
 
-    def Read(self, format=1, bpot=False, bacc=False, bdadt=False, bdt=False):
+        return arrays
+
+    def _memory_dtype(self, dtype):
+        """
+        The type in memory of the elements of a block of the given type in
+        the file: the double precision floats are downcast if asked.
+        """
+        if self._downcast and dtype.kind == "f" and dtype.itemsize > 4:
+            return np.dtype(np.float32)
+        return dtype
+
+    def _ranges(self, label, types=None):
+        """
+        The (filename, offset, size) of the particles of the given types of a
+        block, in every file of the snapshot.
+        """
+        return [
+            (l["filename"], offset, size)
+            for l in self._layout if label in l["blocks"]
+            for offset, size in _type_ranges(l, label, types)
+        ]
+
+    def _ids_ranges(self, label):
+        """
+        The ranges of the identities of the particles stored in a block,
+        which may hold only some types (gas blocks, masses).
+        """
+        ranges = []
+        for l in self._layout:
+            if label not in l["blocks"]:
+                continue
+            npart = _block_npart(label, l["npart"], l["mass"])
+            types = [
+                i for i in range(6)
+                if npart[i] > 0 and (self._types is None or i in self._types)
+            ]
+            ranges += [
+                (l["filename"], offset, size)
+                for offset, size in _type_ranges(l, "ID  ", types)
+            ]
+        return ranges
+
+    def iter_chunks(self, block="POS ", chunk_particles=1048576, ids=False):
+        """
+        Iterate over a block by chunks of chunk_particles particles (the
+        last one may be smaller), with the identities of the particles if
+        ids is set. The chunks are read into the same buffers, so the memory
+        used is bounded whatever the size of the snapshot, and a yielded
+        array must be copied to be kept after the next iteration. Double
+        precision chunks are downcast as the blocks read in memory.
+        """
+        label   = NAMES.get(block, block)
+        layouts = [l for l in self._layout if label in l["blocks"]]
+        if not layouts:
+            raise KeyError(
+                "No block '{0}' in {1}.".format(label, self._filename)
+            )
+
+        dtypes = [_block_dtype(layouts[0], label)]
+        plans  = [_chunk_plan(
+            self._ranges(label, self._types),
+            dtypes[0].itemsize * BLOCKS[label][0],
+            chunk_particles,
+        )]
+        if ids:
+            dtypes.append(_block_dtype(layouts[0], "ID  "))
+            plans.append(_chunk_plan(
+                self._ids_ranges(label), dtypes[1].itemsize, chunk_particles
+            ))
+
+        buffers = [
+            np.empty(chunk_particles * BLOCKS[label][0], dtype=dtypes[0])
+        ]
+        if ids:
+            buffers.append(np.empty(chunk_particles, dtype=dtypes[1]))
+
+        # the buffers of the chunks converted in memory
+        outputs = [
+            None if self._memory_dtype(b.dtype) == b.dtype
+            else np.empty(b.size, dtype=self._memory_dtype(b.dtype))
+            for b in buffers
+        ]
+
+        for chunks in zip(*plans):
+            arrays = []
+            for buffer, output, chunk in zip(buffers, outputs, chunks):
+                raw   = buffer.view(np.uint8)
+                start = 0
+                for filename, offset, size in chunk:
+                    _read_into(filename, offset, raw[start:start + size])
+                    start += size
+                array = buffer[:start // buffer.itemsize]
+                if layouts[0]["swap"]:
+                    array.byteswap(inplace=True)
+                if output is not None:
+                    output[:array.size] = array
+                    array = output[:array.size]
+                arrays.append(array)
+
+            if ids:
+                yield tuple(arrays)
+            else:
+                yield arrays[0]
+
+    def _read_types(self, label, types=None):
+        """
+        Read, or map in memory, the particles of the given types of a block.
+        Return None if the block is not in the snapshot.
+        """
+        if self._subsample is not None:
+            return self._subsample_block(label, types)
+        if self._mmap:
+            if label in self._layout[0]["blocks"]:
+                return _memmap_block(self._layout[0], label, types)
+            return None
+        return self._load_blocks([label], types).get(label)
+
+    def _subsample_block(self, label, types=None):
+        """
+        Read only the particles of a block kept by the subsampling, through
+        fancy indexing of memory mapped views of the files.
+        """
+        layouts = [l for l in self._layout if label in l["blocks"]]
+        if not layouts:
+            return None
+
+        dtype  = _block_dtype(layouts[0], label)
+        ncomp  = BLOCKS[label][0]
+        pieces = []
+        start  = 0
+        for index, l in enumerate(self._layout):
+            npart = _block_npart(label, l["npart"], l["mass"])
+            for i in range(6):
+                if label in l["blocks"] and npart[i] > 0 and \
+                        (types is None or i in types):
+                    rows = _selection(
+                        self._subsample, self._seed, index, start,
+                        l["npart"][i], i,
+                    )
+                    view = _memmap_block(l, label, [i]).reshape(-1, ncomp)
+                    pieces.append(view[rows].ravel())
+                start += l["npart"][i]
+
+        dtype = self._memory_dtype(dtype)
+        if not pieces:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate(pieces).astype(dtype, copy=False)
+
+    def _filenames(self):
+        if self._nb_files == 1:
+            return [self._filename]
+        return [
+            "{0}.{1}".format(self._filename, i) for i in range(self._nb_files)
+        ]
+
+    def Read(self, format=1, bpot=False, bacc=False, bdadt=False, bdt=False,
+             mmap=False, types=None, subsample=None, seed=0, downcast=True):
+        """
+        Read the snapshot. Only the headers and the table of the blocks are
+        read: each block is read from the disk the first time its property
+        (positions, velocities, ids...) is accessed. The flags tell which of
+        the optional blocks (potential, accelerations, rate of entropy,
+        time steps) are in a format 1 file.
+
+        With mmap, the blocks are exposed as read-only memory mapped views,
+        so pages are only read when touched and shared with the other
+        processes through the page cache.
+
+        With types, a list of particle types, only the particles of those
+        types are read from each block.
+
+        With subsample, only a part of the particles is read for a quick
+        look: an integer keeps one particle every subsample, a float in
+        ]0, 1] keeps randomly this fraction of the particles, drawn
+        reproducibly from the seed. Calling Read again without subsample
+        reads the full resolution.
+
+        With downcast, the blocks written in double precision are converted
+        to single precision while read, chunk by chunk. The memory mapped
+        views keep the type of the file.
+        """
+        self._subsample = _check_subsample(subsample)
+        self._seed  = seed
+        self._downcast = downcast
+        self._types = None if types is None else set(types)
         if format == 1:
-            self._read_format1(bpot, bacc, bdadt, bdt)
+            self._read_format1(bpot, bacc, bdadt, bdt, mmap)
         elif format == 2:
-            self._read_format2(bpot, bacc, bdadt, bdt)
+            self._read_format2(bpot, bacc, bdadt, bdt, mmap)
 
-    def Write(self, format=1):
+    def Write(self, filename=None, format=1, num_files=1, blocks=None):
+        """
+        Write the snapshot in the given format, by default over the read
+        file, split in num_files files. The blocks written are the given
+        labels, else every block in memory or in the read snapshot, and npart
+        must give the number of particles of each type of the blocks.
+        """
         if format == 1:
-            self.Write = self._write_format1
+            self._write_format1(filename, num_files, blocks)
         elif format == 2:
-            self.Write = self._write_format2
+            self._write_format2(filename, num_files, blocks)
+
+    def set_block(self, label, array):
+        """
+        Set the data of a block, to be written by Write.
+        """
+        label = NAMES.get(label, label)
+        if label not in BLOCKS:
+            raise KeyError("Unknown block '{0}'.".format(label))
+        self._blocks[label] = np.ascontiguousarray(array).ravel()
 
     #property Part:
         #def __get__(self):
@@ -210,12 +1189,90 @@ The only gadget file format supported is the gadget 1.
             #else:
                 #raise TypeError("You must passed a InitialCond.Types.Particules!")
 
+    def block(self, label):
+        """
+        Return the block of the given label ("POS ", "ID  ", "MASS"...). A
+        block not yet in memory is read by seeking straight to it in every
+        file, without reading the blocks before it, and kept until dropped.
+        """
+        label = NAMES.get(label, label)
+        if label not in BLOCKS:
+            raise KeyError("Unknown block '{0}'.".format(label))
+        if label not in self._blocks:
+            array = self._read_types(label, self._types)
+            if array is not None:
+                self._blocks[label] = array
+        if label not in self._blocks:
+            raise KeyError(
+                "No block '{0}' in {1}.".format(label, self._filename)
+            )
+        return self._blocks[label]
+
+    def drop(self, label):
+        """
+        Free the memory used by a block, which will be read again from the
+        disk if accessed.
+        """
+        self._blocks.pop(NAMES.get(label, label), None)
+
+    def type(self, ptype):
+        """
+        Return the blocks of a single type of particles, as in
+        reader.type(1).positions, reading only the slice of that type.
+        """
+        if ptype not in self._particle_types:
+            self._particle_types[ptype] = ParticleType(self, ptype)
+        return self._particle_types[ptype]
+
+    property blocks:
+        def __get__(self):
+            if not self._layout:
+                return []
+            return list(self._layout[0]["blocks"])
+
+    property filename:
+        def __get__(self):
+            return self._filename
+
+    property subsample:
+        def __get__(self):
+            return self._subsample
+
     property positions:
         def __get__(self):
-            return self._pos
+            return self.block("POS ")
+        def __set__(self, value):
+            self.set_block("POS ", value)
     property velocities:
         def __get__(self):
-            return self._vel
+            return self.block("VEL ")
+        def __set__(self, value):
+            self.set_block("VEL ", value)
+    property ids:
+        def __get__(self):
+            return self.block("ID  ")
+        def __set__(self, value):
+            self.set_block("ID  ", value)
+    property masses:
+        def __get__(self):
+            return self.block("MASS")
+        def __set__(self, value):
+            self.set_block("MASS", value)
+    property internal_energy:
+        def __get__(self):
+            return self.block("U   ")
+        def __set__(self, value):
+            self.set_block("U   ", value)
+    property density:
+        def __get__(self):
+            return self.block("RHO ")
+        def __set__(self, value):
+            self.set_block("RHO ", value)
+    property smoothing_length:
+        def __get__(self):
+            return self.block("HSML")
+        def __set__(self, value):
+            self.set_block("HSML", value)
 
     property npartTotalHighWord:
         @cython.boundscheck(False)
@@ -231,6 +1288,32 @@ The only gadget file format supported is the gadget 1.
             for i in range(6):
                 self._header.npartTotalHighWord[i] = value[i]
 
+    property npartTotal:
+        @cython.boundscheck(False)
+        def __get__(self):
+            res = [0]*6
+            for i in range(6):
+                res[i] = self._header.npartTotal[i]
+            return res
+        @cython.boundscheck(False)
+        def __set__(self, value):
+            if len(value) != 6:
+                raise ValueError("You should past a list of 6 integers!")
+            for i in range(6):
+                self._header.npartTotal[i] = value[i]
+
+    property npart_total:
+        def __get__(self):
+            """
+            The total number of particles of each type of the snapshot, on 64
+            bits from npartTotal and npartTotalHighWord.
+            """
+            return [
+                self._header.npartTotal[i] +
+                (<unsigned long long>self._header.npartTotalHighWord[i] << 32)
+                for i in range(6)
+            ]
+
     property npart:
         @cython.boundscheck(False)
         def __get__(self):
@@ -337,3 +1420,58 @@ The only gadget file format supported is the gadget 1.
         def __set__(self, value):
             self._header.flag_entropy_instead_u = value
 
+
+class ParticleType(object):
+    """
+    The blocks of a single type of particles of a snapshot, read from the
+    disk the first time they are accessed.
+    """
+
+    def __init__(self, reader, ptype):
+        self._reader = reader
+        self._type   = ptype
+        self._blocks = {}
+
+    def block(self, label):
+        label = NAMES.get(label, label)
+        if label not in self._blocks:
+            array = self._reader._read_types(label, [self._type])
+            if array is None:
+                raise KeyError(
+                    "No block '{0}' in {1}.".format(
+                        label, self._reader.filename
+                    )
+                )
+            self._blocks[label] = array
+        return self._blocks[label]
+
+    def drop(self, label):
+        self._blocks.pop(NAMES.get(label, label), None)
+
+    @property
+    def positions(self):
+        return self.block("POS ")
+
+    @property
+    def velocities(self):
+        return self.block("VEL ")
+
+    @property
+    def ids(self):
+        return self.block("ID  ")
+
+    @property
+    def masses(self):
+        return self.block("MASS")
+
+    @property
+    def internal_energy(self):
+        return self.block("U   ")
+
+    @property
+    def density(self):
+        return self.block("RHO ")
+
+    @property
+    def smoothing_length(self):
+        return self.block("HSML")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .Reader import GadgetReader, NAMES
+
+
+class SnapshotSequence(object):
+    """
+    An ordered sequence of snapshots, as the outputs of a simulation, whose
+    neighbours of the current snapshot are read in the background so that
+    stepping through the sequence doesn't wait for the disk.
+    """
+
+    def __init__(
+        self,
+        filenames,
+        numfile=1,
+        format=1,
+        block="POS ",
+        capacity=3,
+        **kwargs
+    ):
+        """
+        An ordered sequence of snapshots.
+
+        :params filenames: the ordered list of the snapshots.
+        :params numfile: the number of files of each snapshot.
+        :params format: the gadget format of the files.
+        :params block: the block read in advance for each snapshot.
+        :params capacity: the maximal number of snapshots kept in memory,
+            at least the current one and its next and previous ones.
+        :params kwargs: the keyword arguments of GadgetReader.Read.
+        """
+        if capacity < 3:
+            raise ValueError("The capacity must be at least 3 snapshots.")
+
+        self._filenames = list(filenames)
+        self._numfile = numfile
+        self._format = format
+        self._block = NAMES.get(block, block)
+        self._capacity = capacity
+        self._kwargs = kwargs
+
+        # the ring of the read snapshots, the last used being the last
+        self._ring = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._index = 0
+        self._prefetch()
+
+    @classmethod
+    def from_catalog(cls, catalog, **kwargs):
+        """
+        The sequence of the snapshots of a GadgetCatalog, ordered by time.
+        """
+        order = np.argsort(catalog.table["time"], kind="mergesort")
+        return cls([catalog.path(i) for i in order], **kwargs)
+
+    def __len__(self):
+        return len(self._filenames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def format(self):
+        return self._format
+
+    @property
+    def filename(self):
+        return self._filenames[self._index]
+
+    @property
+    def current(self):
+        """
+        The reader of the current snapshot, waiting for it if not yet read.
+        """
+        return self._ring[self._index].result()
+
+    @property
+    def data(self):
+        return self.current.block(self._block)
+
+    def _load(self, index):
+        reader = GadgetReader(self._filenames[index], self._numfile)
+        reader.Read(format=self._format, **self._kwargs)
+        reader.block(self._block)
+        return reader
+
+    def _request(self, index):
+        if index not in self._ring:
+            self._ring[index] = self._pool.submit(self._load, index)
+        self._ring.move_to_end(index)
+
+    def _prefetch(self):
+        """
+        Ask for the current snapshot then its next and previous ones, and
+        forget the least recently used beyond the capacity.
+        """
+        self._request(self._index)
+        for index in (self._index + 1, self._index - 1):
+            if 0 <= index < len(self):
+                self._request(index)
+
+        while len(self._ring) > self._capacity:
+            index, future = self._ring.popitem(last=False)
+            future.cancel()
+
+    def seek(self, index):
+        """
+        Go to the snapshot of the given index, and return its data.
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("No snapshot {0} in the sequence.".format(index))
+        self._index = index
+        self._prefetch()
+        return self.data
+
+    def step(self, n=1):
+        """
+        Move of n snapshots in the sequence, stopping at its ends, and
+        return the data of the new current snapshot.
+        """
+        return self.seek(min(max(self._index + n, 0), len(self) - 1))
+
+    def next(self):
+        return self.step(1)
+
+    def previous(self):
+        return self.step(-1)
+
+    def close(self):
+        for future in self._ring.values():
+            future.cancel()
+        self._ring.clear()
+        self._pool.shutdown(wait=True)
+
+# vim: set tw=79 :
@@ -2,3 +2,7 @@
 
 from .Reader import *
 from .Gadget import *
+from .Catalog import GadgetCatalog
+from .Cache import CachedSnapshot, export_cache, open_snapshot
+from .Sequence import SnapshotSequence
+from .HDF5 import GadgetHDF5
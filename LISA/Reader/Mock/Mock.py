@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import logging
 import numpy as np
 import LISA.utils.colormaps as CM
 import LISA.tools as t
 
+from concurrent.futures import ThreadPoolExecutor
+
 from OpenGL import GL
 from OpenGL.arrays import numpymodule
 # from PyQt4 import QtGui as Qt
@@ -17,11 +20,16 @@ from LISA.OpenGL import Shaders
 
 numpymodule.NumpyHandler.ERROR_ON_COPY = True
 
+_Mock_logger = logging.getLogger("Mock")
+
 
 class Mock(ReadMock):
 
     def __init__(self, *args, **kwargs):
 
+        # the queries of the viewer are read without pandas
+        kwargs.setdefault("backend", "numpy")
+
         # set the reader
         super(Mock, self).__init__(*args, **kwargs)
 
@@ -29,6 +37,12 @@ class Mock(ReadMock):
         self.widgetChanged = Signal()
         self.widgetChanged.connect(self.updateWidget)
 
+        # the quantities are loaded in a worker thread, the signal being
+        # emitted from it when a load is done
+        self.quantityLoaded = Signal()
+        self._loader = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
         # load data from mock catalogue
         self._load_data()
 
@@ -37,7 +51,7 @@ class Mock(ReadMock):
 
         # colormap
         colormap = getattr(CM, "LinearInterpolation")
-        self._colormap = colormap(self._data[self._quantity].values)
+        self._colormap = colormap(self._data[self._quantity])
         self._callback_colormap()
         self._colormap.changed.connect(self._callback_colormap)
 
@@ -49,28 +63,36 @@ class Mock(ReadMock):
         self._shaders += t.shader_path("reader/mock/couleurs.fsh")
 
     def _callback_colormap(self):
-        self._color = self._colormap(self._data[self._quantity].values)
+        self._color = self._colormap(self._data[self._quantity])
 
     def _load_data(self):
 
-        # store the data of the mock catalogue
-        self._data = self.__call__(
-            select="positions_x, positions_y, positions_z, alpha, delta, " +
-            "redshift"
+        # store the data of the mock catalogue, as float32 columns mapped
+        # from the column cache
+        self._data = self.columns(
+            "positions_x", "positions_y", "positions_z", "alpha", "delta",
+            "redshift",
         )
 
         # rescale data
         for i in "xyz":
             field = "positions_{0}".format(i)
-            self._data[field] = (
-                self._data[field] - self._data[field].min()
-            ) / (self._data[field].max() - self._data[field].min())
+            self._data[field] = self._rescale(self._data[field])
 
         field = "redshift"
         self._quantity = field
-        self._data[field] = (
-            self._data[field] - self._data[field].min()
-        ) / (self._data[field].max() - self._data[field].min())
+        self._data[field] = self._rescale(self._data[field])
+
+        # the buffers of the projections, made for the new data
+        self._unit = None
+        self._pos = None
+
+    @staticmethod
+    def _rescale(column):
+        # the missing values (NULL, read as NaN) are ignored
+        scaled = column - np.nanmin(column)
+        scaled /= np.nanmax(scaled)
+        return scaled
 
     def createShaders(self, parent):
 
@@ -82,6 +104,9 @@ class Mock(ReadMock):
 
     def show(self, parent):
 
+        # the colours of a quantity loaded since the last frame
+        self._swap_quantity()
+
         GL.glClear(GL.GL_DEPTH_BUFFER_BIT | GL.GL_COLOR_BUFFER_BIT)
 
         matrice = parent._view * parent._model
@@ -185,20 +210,52 @@ class Mock(ReadMock):
         # self._colormap.createWidget(self._dialog.layout())
 
     def _load_quantity(self, quantity):
-        if quantity not in self._data:
-            try:
-                self._data[quantity] = self.__call__(select=quantity)
-                self._quantity = quantity
-                self._colormap.data = self._data[self._quantity].values
-                self._callback_colormap()
-            except:
-                pass
+        """
+        Load a quantity to colour the galaxies in the worker thread, without
+        blocking the rendering, and return the future of its column. The
+        colours are swapped in at the first frame after the load, and only
+        for the last quantity asked.
+        """
+        if quantity in self._data:
+            future = self._loader.submit(lambda: self._data[quantity])
+        else:
+            future = self._loader.submit(
+                lambda: self.columns(quantity)[quantity]
+            )
+        self._pending = (quantity, future)
+
+        def done(future):
+            if future.exception() is None:
+                self.quantityLoaded(quantity)
+        future.add_done_callback(done)
+        return future
+
+    def _swap_quantity(self):
+        """
+        Colour the galaxies with the last quantity asked if loaded.
+        """
+        if self._pending is None or not self._pending[1].done():
+            return
+        quantity, future = self._pending
+        self._pending = None
+
+        error = future.exception()
+        if error is not None:
+            _Mock_logger.warning(
+                "Can't load the quantity %s: %s", quantity, error
+            )
+            return
+
+        self._data[quantity] = future.result()
+        self._quantity = quantity
+        self._colormap.data = self._data[self._quantity]
+        self._callback_colormap()
 
     def _colormap_changed(self, text):
 
         # get the new colormap
         colormap = getattr(CM, text)
-        self._colormap = colormap(self._data[self._quantity].values)
+        self._colormap = colormap(self._data[self._quantity])
         self._callback_colormap()
         self._colormap.changed.connect(self._callback_colormap)
         self.widgetChanged()
@@ -210,31 +267,50 @@ class Mock(ReadMock):
         method = getattr(self, "_projection_" + projection)
         method()
 
+    def _unit_vectors(self):
+        """
+        The unit vectors of the directions of the galaxies on the sky,
+        interleaved in float32, computed once.
+        """
+        if self._unit is None:
+            alpha = self._data["alpha"]
+            delta = self._data["delta"]
+            self._unit = np.empty(3 * alpha.size, dtype=np.float32)
+            unit = self._unit.reshape(-1, 3)
+
+            cos_delta = np.cos(delta, dtype=np.float32)
+            np.cos(alpha, out=unit[:, 0])
+            unit[:, 0] *= cos_delta
+            np.sin(alpha, out=unit[:, 1])
+            unit[:, 1] *= cos_delta
+            np.sin(delta, out=unit[:, 2])
+        return self._unit
+
+    def _position_buffer(self):
+        """
+        The interleaved positions, allocated once and overwritten by each
+        projection.
+        """
+        size = 3 * self._data["alpha"].size
+        if self._pos is None or self._pos.size != size:
+            self._pos = np.empty(size, dtype=np.float32)
+        return self._pos
+
     def _projection_celestial_sphere(self):
-        X = np.cos(self._data["alpha"]) * np.cos(self._data["delta"])
-        Y = np.sin(self._data["alpha"]) * np.cos(self._data["delta"])
-        Z = np.sin(self._data["delta"])
-        self._pos = np.vstack([X, Y, Z]).T.astype(np.float32).flatten()
+        np.copyto(self._position_buffer(), self._unit_vectors())
 
     def _projection_cartesian(self):
-        self._pos = np.vstack([
-            self._data["positions_x"].values,
-            self._data["positions_y"].values,
-            self._data["positions_z"].values,
-        ]).T.astype(np.float32).flatten()
+        # interleave the columns straight into the positions
+        pos = self._position_buffer()
+        for i, axis in enumerate("xyz"):
+            pos[i::3] = self._data["positions_{0}".format(axis)]
 
     def _projection_redshift_space(self):
-        redshift = self._data["redshift"]
-        X = np.cos(self._data["alpha"]) * np.cos(self._data["delta"])
-        Y = np.sin(self._data["alpha"]) * np.cos(self._data["delta"])
-        Z = np.sin(self._data["delta"])
-        self._pos = np.vstack(
-            [
-                redshift * X,
-                redshift * Y,
-                redshift * Z
-            ]
-        ).T.astype(np.float32).flatten()
+        np.multiply(
+            self._unit_vectors().reshape(-1, 3),
+            self._data["redshift"][:, np.newaxis],
+            out=self._position_buffer().reshape(-1, 3),
+        )
 
     def _set_voxelsize(self, value):
         self._voxelSize = value / 100. * self._voxelSize_max
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import hashlib
+import numpy as np
+
+from urllib.parse import quote
+
+from LISA.tools.common import CACHE_DIR
+
+
+class ColumnCache(object):
+    """
+    A cache of the columns read from a SQLite database, kept as .npy files in
+    the user cache directory and memory mapped when read again. The columns
+    are keyed by the path and modification time of the database, the table
+    and the column, so a modified database is read again.
+    """
+
+    def __init__(self, database, directory=None):
+        """
+        A cache of the columns of a database.
+
+        :params database: the path to the database.
+        :params directory: the directory of the cache, by default in the
+            user cache directory.
+        """
+        self._database = os.path.abspath(database)
+        if directory is None:
+            key = hashlib.sha1(self._database.encode()).hexdigest()
+            directory = os.path.join(CACHE_DIR, "mock", key)
+        self._directory = directory
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _prefix(self, table, column):
+        return os.path.join(
+            self._directory,
+            "{0}.{1}.".format(quote(table, safe=""), quote(column, safe="")),
+        )
+
+    def _path(self, table, column):
+        mtime = os.stat(self._database).st_mtime_ns
+        return "{0}{1}.npy".format(self._prefix(table, column), mtime)
+
+    def get(self, table, column):
+        """
+        The memory mapped column of a table, None if not in the cache or
+        older than the database.
+        """
+        try:
+            return np.load(self._path(table, column), mmap_mode="r")
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, table, column, array):
+        """
+        Store a column of a table in the cache, forgetting its versions of
+        older databases, and return it memory mapped.
+        """
+        path = self._path(table, column)
+        os.makedirs(self._directory, exist_ok=True)
+        for old in glob.glob(glob.escape(self._prefix(table, column)) + "*"):
+            os.remove(old)
+
+        # written aside, so a concurrent reader never maps a partial file
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+        return np.load(path, mmap_mode="r")
+
+    def clear(self):
+        """
+        Remove all the columns of the database from the cache.
+        """
+        for path in glob.glob(os.path.join(self._directory, "*.npy")):
+            os.remove(path)
+
+# vim: set tw=79 :
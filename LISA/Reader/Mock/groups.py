@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+
+class GroupTable(object):
+    """
+    The galaxies of a catalogue grouped by their group identity. The
+    identities are factorised once into compact keys, with the galaxies
+    sorted by group (the members of the group i being the rows
+    order[offsets[i]:offsets[i + 1]]), so each statistic over all the
+    groups is a single pass of np.bincount or of a ufunc reduceat.
+    """
+
+    def __init__(self, galaxies, key="group_id"):
+        """
+        The galaxies grouped by their group identity.
+
+        :params galaxies: a DataFrame, a structured array or a dictionary
+            of columns of the galaxies.
+        :params key: the field of the identity of the group of a galaxy.
+        """
+        self._galaxies = galaxies
+        self._key_field = key
+
+        self._groups, self._key = np.unique(
+            np.asarray(galaxies[key]), return_inverse=True
+        )
+        self._key = self._key.ravel()
+        self._richness = np.bincount(self._key, minlength=len(self._groups))
+        self._order = np.argsort(self._key, kind="mergesort")
+        self._offsets = np.zeros(len(self._groups) + 1, dtype=np.int64)
+        np.cumsum(self._richness, out=self._offsets[1:])
+
+    @property
+    def galaxies(self):
+        return self._galaxies
+
+    @property
+    def groups(self):
+        """
+        The identities of the groups, sorted.
+        """
+        return self._groups
+
+    @property
+    def key(self):
+        """
+        The index of the group of each galaxy in groups.
+        """
+        return self._key
+
+    @property
+    def order(self):
+        return self._order
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    @property
+    def richness(self):
+        """
+        The number of galaxies of each group.
+        """
+        return self._richness
+
+    def __len__(self):
+        return len(self._groups)
+
+    def members(self, i):
+        """
+        The rows of the galaxies of the group of index i.
+        """
+        return self._order[self._offsets[i]:self._offsets[i + 1]]
+
+    def groupby(self):
+        """
+        The pandas grouping of the galaxies, for the other statistics.
+        """
+        galaxies = self._galaxies
+        if not isinstance(galaxies, pd.DataFrame):
+            galaxies = pd.DataFrame(galaxies)
+        return galaxies.groupby(self._key_field)
+
+    def _column(self, column):
+        if isinstance(column, str):
+            return np.asarray(self._galaxies[column], dtype=np.float64)
+        return np.asarray(column, dtype=np.float64)
+
+    def _table(self, columns, values):
+        return pd.DataFrame(
+            dict(zip(columns, values)),
+            index=pd.Index(self._groups, name=self._key_field),
+            columns=list(columns),
+        )
+
+    def _sum(self, values):
+        return np.bincount(self._key, weights=values, minlength=len(self))
+
+    def sum(self, *columns):
+        """
+        The sums of the columns over each group.
+        """
+        return self._table(
+            columns, [self._sum(self._column(c)) for c in columns]
+        )
+
+    def mean(self, *columns, **kwargs):
+        """
+        The means of the columns over each group, weighted by the column
+        given as the keyword weights if any.
+        """
+        weights = kwargs.get("weights")
+        if weights is None:
+            norm = self._richness
+            values = [self._sum(self._column(c)) / norm for c in columns]
+        else:
+            weights = self._column(weights)
+            norm = self._sum(weights)
+            values = [
+                self._sum(weights * self._column(c)) / norm for c in columns
+            ]
+        return self._table(columns, values)
+
+    def var(self, *columns, **kwargs):
+        """
+        The variances of the columns in each group, from their deviations
+        to the means of the groups. The keyword ddof gives the delta of the
+        degrees of freedom, 1 by default as in pandas.
+        """
+        ddof = kwargs.get("ddof", 1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            norm = (self._richness - ddof).astype(np.float64)
+            norm[norm <= 0] = np.nan
+            values = []
+            for c in columns:
+                column = self._column(c)
+                mean = self._sum(column) / self._richness
+                deviation = (column - mean[self._key]) ** 2
+                values.append(self._sum(deviation) / norm)
+        return self._table(columns, values)
+
+    def std(self, *columns, **kwargs):
+        """
+        The standard deviations of the columns in each group.
+        """
+        return np.sqrt(self.var(*columns, **kwargs))
+
+    def reduce(self, ufunc, *columns):
+        """
+        The reductions of the columns over each group by a ufunc, as
+        np.maximum or np.minimum, through its reduceat on the galaxies
+        sorted by group.
+        """
+        starts = self._offsets[:-1]
+        return self._table(
+            columns,
+            [
+                ufunc.reduceat(self._column(c)[self._order], starts)
+                if len(self) else np.empty(0)
+                for c in columns
+            ],
+        )
+
+    def min(self, *columns):
+        return self.reduce(np.minimum, *columns)
+
+    def max(self, *columns):
+        return self.reduce(np.maximum, *columns)
+
+    def centre_of_mass(
+        self,
+        columns=("positions_x", "positions_y", "positions_z"),
+        weights=None,
+    ):
+        """
+        The centres of the groups, weighted by the column weights (as the
+        masses or the luminosities of the galaxies) if given.
+        """
+        return self.mean(*columns, weights=weights)
+
+    def velocity_dispersion(
+        self,
+        columns=("velocities_x", "velocities_y", "velocities_z"),
+        ddof=1,
+    ):
+        """
+        The dispersion of the velocities of the galaxies of each group, the
+        square root of the mean of the variances of the components.
+        """
+        variances = self.var(*columns, ddof=ddof)
+        return np.sqrt(variances.mean(axis=1, skipna=False))
+
+# vim: set tw=79 :
@@ -1,8 +1,57 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import pandas as pd
 
-from .read_sql import ReadSQL
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .read_sql import ReadSQL, get_engine
+from .column_cache import ColumnCache
+from .groups import GroupTable
+
+
+# the R*Tree indexes of the mock catalogue: name -> (table, indexed fields)
+INDEXES = {
+    "sky": ("MOCK_sky_index", ("alpha", "delta", "redshift")),
+    "cartesian": (
+        "MOCK_cartesian_index", ("positions_x", "positions_y", "positions_z")
+    ),
+}
+
+# the column of the uniform random keys ordering the galaxies for the
+# samples of the catalogue
+RANDOM_KEY = "random_key"
+
+
+def _names(table):
+    """
+    The names of the fields of a DataFrame, a structured array or a
+    dictionary of columns.
+    """
+    if isinstance(table, np.ndarray):
+        return list(table.dtype.names)
+    return list(table.keys())
+
+
+def _exact_keys(left, right):
+    """
+    The integer keys of a join converted to a single integer type in which
+    they compare exactly, None if there is none. numpy compares uint64 and
+    signed integers as float64, which loses the identities above 2**53.
+    """
+    dtype = np.result_type(left.dtype, right.dtype)
+    if dtype.kind not in "iu":
+        # uint64 and a signed type
+        unsigned, signed = (left, right) if left.dtype.kind == "u" else \
+            (right, left)
+        if not unsigned.size or unsigned.max() <= np.iinfo(np.int64).max:
+            dtype = np.int64
+        elif not signed.size or signed.min() >= 0:
+            dtype = np.uint64
+        else:
+            return None
+    return left.astype(dtype, copy=False), right.astype(dtype, copy=False)
 
 
 class ReadMock(object):
@@ -10,7 +59,7 @@ class ReadMock(object):
     A class to read data from the mock catalog of galaxies.
     """
 
-    def __init__(self, database, old=False):
+    def __init__(self, database, old=False, backend="pandas"):
         """
         A class to read data from the mock catalog of galaxies.
 
@@ -18,10 +67,16 @@ class ReadMock(object):
             catalogue data.
         :params old: a parameter to make the class compatible with old
             versions of the mock catalogue structure.
+        :params backend: the backend of the results of the queries,
+            "pandas" for DataFrames or "numpy" for structured arrays.
         """
+        self._backend = backend
         self.database = database
         self.old = old
 
+        # the snapshot last joined, with its sorted identities
+        self._join_cache = None
+
     @property
     def database(self):
         return self._database
@@ -30,6 +85,15 @@ class ReadMock(object):
     def old(self):
         return self._old
 
+    @property
+    def backend(self):
+        return self._sql.backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+        self._sql.backend = backend
+
     @property
     def left_on(self):
         return self._left_on
@@ -53,7 +117,14 @@ class ReadMock(object):
         self._database = database
 
         # set the SQL object for the connection
-        self._sql = ReadSQL(database)
+        self._sql = ReadSQL(database, backend=self._backend)
+
+        # the columns already read, on the disk
+        self._cache = ColumnCache(database)
+
+        # the spatial indexes known to be in the database
+        self._indexes = set()
+        self._random_key = False
 
     @old.setter
     def old(self, old):
@@ -71,7 +142,8 @@ class ReadMock(object):
         Just need to pas as keyword arguments the different fields
         needed for an SQL query as for example "select", "where"; etc...
         Returns a DataFrame containing the different fields with filtration
-        specified in "select".
+        specified in "select", or a structured array with the numpy
+        backend (see ReadSQL).
         """
 
         # add the table from which to read
@@ -80,14 +152,311 @@ class ReadMock(object):
         # return data
         return self._sql(**kwargs)
 
+    def stream(self, **kwargs):
+        """
+        As calling the instance, but returns the fields as contiguous
+        float32 columns, read by chunks (see ReadSQL.stream).
+        """
+
+        # add the table from which to read
+        kwargs.update({"from": "MOCK"})
+
+        return self._sql.stream(**kwargs)
+
+    def columns(self, *names):
+        """
+        The float32 columns of the given fields, memory mapped from the
+        column cache, only the fields not yet in the cache being read from
+        the database (and then stored in the cache).
+        """
+
+        columns = OrderedDict(
+            (name, self._cache.get("MOCK", name)) for name in names
+        )
+        missing = [name for name, column in columns.items() if column is None]
+        if missing:
+            streamed = self.stream(select=", ".join(missing))
+            for name, column in zip(missing, streamed.values()):
+                columns[name] = self._cache.put("MOCK", name, column)
+        return columns
+
+    def spatial_index(self, name="sky"):
+        """
+        Build, if not already in the database, the R*Tree index over the
+        sky coordinates (alpha, delta, redshift) or the cartesian positions
+        of the galaxies, and return the name of its table. The index is
+        built once and kept in the database for the next sessions.
+        """
+
+        table, fields = INDEXES[name]
+        if name in self._indexes:
+            return table
+
+        engine = get_engine(self.database, writable=True)
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name = ?", (table,)
+            )
+            if cursor.fetchone() is None:
+                bounds = ", ".join(
+                    "min_{0}, max_{0}".format(field) for field in fields
+                )
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE {0} USING rtree(id, {1})".format(
+                        table, bounds,
+                    )
+                )
+                cursor.execute(
+                    "INSERT INTO {0} SELECT rowid, {1} FROM MOCK".format(
+                        table,
+                        ", ".join(
+                            "{0}, {0}".format(field) for field in fields
+                        ),
+                    )
+                )
+                connection.commit()
+            cursor.close()
+        finally:
+            connection.close()
+
+        self._indexes.add(name)
+        return table
+
+    def _fields(self, query, params=(), dtypes=None):
+        """
+        The columns of the fields of a SQL query, as views of a structured
+        array read straight from the cursor: float32 for the reals, int64
+        for the integers, unless given otherwise in the dictionary dtypes.
+        """
+
+        array = self._sql.structured_query(query, params, dtypes=dtypes)
+        return OrderedDict((name, array[name]) for name in array.dtype.names)
+
+    def _region(self, select, boxes, index, dtypes=None):
+        """
+        The columns of the fields of select for the galaxies in the union of
+        boxes, each one a dictionary of (min, max) by field of the index,
+        read through the R*Tree index.
+        """
+
+        table, fields = INDEXES[index]
+        self.spatial_index(index)
+
+        clauses = []
+        params = []
+        for box in boxes:
+            conditions = []
+            for field, (low, high) in box.items():
+                # the index is conservative, the fields of the table exact
+                conditions.append(
+                    "r.max_{0} >= ? AND r.min_{0} <= ? AND "
+                    "MOCK.{0} BETWEEN ? AND ?".format(field)
+                )
+                params += [low, high, low, high]
+            clauses.append("(" + " AND ".join(conditions or ["1"]) + ")")
+
+        query = (
+            "SELECT {0} FROM MOCK JOIN {1} AS r ON MOCK.rowid = r.id "
+            "WHERE {2}".format(
+                ", ".join("MOCK." + f.strip() for f in select.split(",")),
+                table,
+                " OR ".join(clauses),
+            )
+        )
+        return self._fields(query, params, dtypes)
+
+    def query_box(self, select, dtypes=None, **bounds):
+        """
+        The columns of the fields of select (as in a "select" of a query)
+        for the galaxies in a box, given as (min, max) for some of the
+        fields of one of the indexes: alpha, delta and redshift, or
+        positions_x, positions_y and positions_z. Only the galaxies of the
+        box are read, through the R*Tree index of the fields. The reals are
+        read as float32 and the integers as int64, unless given otherwise
+        in the dictionary dtypes.
+        """
+
+        for index, (table, fields) in INDEXES.items():
+            if set(bounds) <= set(fields):
+                return self._region(select, [bounds], index, dtypes)
+
+        raise ValueError(
+            "No index over all the fields {0}.".format(sorted(bounds))
+        )
+
+    def query_cone(self, select, alpha, delta, radius, redshift=None,
+                   dtypes=None):
+        """
+        The columns of the fields of select (as in a "select" of a query)
+        for the galaxies in a cone of the sky, of angular radius radius
+        around (alpha, delta), all in radians, and optionally between the
+        (min, max) of redshift. The boxes bounding the cone are read
+        through the R*Tree index of the sky coordinates, then the galaxies
+        out of the cone removed. The types of the columns are the ones of
+        query_box.
+        """
+
+        low, high = delta - radius, delta + radius
+        if low <= -np.pi / 2 or high >= np.pi / 2:
+            # the cone contains a pole
+            ranges = [(0., 2 * np.pi)]
+            low, high = max(low, -np.pi / 2), min(high, np.pi / 2)
+        else:
+            width = np.arcsin(np.sin(radius) / np.cos(delta))
+            first, last = alpha - width, alpha + width
+            ranges = [(max(first, 0.), min(last, 2 * np.pi))]
+            if first < 0:
+                ranges.append((first + 2 * np.pi, 2 * np.pi))
+            if last > 2 * np.pi:
+                ranges.append((0., last - 2 * np.pi))
+
+        boxes = []
+        for box in ranges:
+            boxes.append({"alpha": box, "delta": (low, high)})
+            if redshift is not None:
+                boxes[-1]["redshift"] = redshift
+
+        dtypes = {} if dtypes is None else dict(dtypes)
+        dtypes.update(cone_alpha=np.float64, cone_delta=np.float64)
+        columns = self._region(
+            select + ", alpha AS cone_alpha, delta AS cone_delta",
+            boxes,
+            "sky",
+            dtypes,
+        )
+
+        # the exact selection of the cone
+        a = columns.pop("cone_alpha")
+        d = columns.pop("cone_delta")
+        inside = np.sin(d) * np.sin(delta) + \
+            np.cos(d) * np.cos(delta) * np.cos(a - alpha) >= np.cos(radius)
+        return OrderedDict(
+            (name, column[inside]) for name, column in columns.items()
+        )
+
+    def random_key(self):
+        """
+        Add, if not already in the database, the indexed column of uniform
+        random keys in [0, 1[ of the galaxies, from which the samples of the
+        catalogue are read. The column is added once and kept in the
+        database for the next sessions.
+        """
+
+        if self._random_key:
+            return RANDOM_KEY
+
+        engine = get_engine(self.database, writable=True)
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA table_info(MOCK)")
+            if RANDOM_KEY not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute(
+                    "ALTER TABLE MOCK ADD COLUMN {0} REAL".format(RANDOM_KEY)
+                )
+                # random() is uniform over the 64 bits integers
+                cursor.execute(
+                    "UPDATE MOCK SET {0} = random() / 18446744073709551616.0 "
+                    "+ 0.5".format(RANDOM_KEY)
+                )
+                cursor.execute(
+                    "CREATE INDEX MOCK_{0} ON MOCK({0})".format(RANDOM_KEY)
+                )
+                connection.commit()
+            cursor.close()
+        finally:
+            connection.close()
+
+        self._random_key = True
+        return RANDOM_KEY
+
+    def _slice(self, select, low, high, dtypes=None):
+        """
+        The columns of the fields of select for the galaxies whose random
+        key is in [low, high[, the last slice (high >= 1) taking also the
+        galaxies added without key.
+        """
+
+        if high >= 1.:
+            condition = "{0} >= ? OR {0} IS NULL".format(RANDOM_KEY)
+            params = (low,)
+        else:
+            condition = "{0} >= ? AND {0} < ?".format(RANDOM_KEY)
+            params = (low, high)
+        return self._fields(
+            "SELECT {0} FROM MOCK WHERE {1}".format(select, condition),
+            params,
+            dtypes,
+        )
+
+    def sample(self, fraction, select, dtypes=None):
+        """
+        The columns of the fields of select (as in a "select" of a query)
+        for a uniform random sample of the given fraction of the galaxies,
+        always the same, read through the index of the random keys. The
+        reals are read as float32 and the integers as int64, unless given
+        otherwise in the dictionary dtypes.
+        """
+
+        self.random_key()
+        return self._slice(select, 0., fraction, dtypes)
+
+    def progressive(self, select, levels=(0.01, 0.1, 1.), dtypes=None):
+        """
+        Iterate over the fields of select (as in a "select" of a query) by
+        slices of random galaxies, the galaxies of the first slice being a
+        sample of the fraction levels[0] of the catalogue, and each next
+        slice adding the galaxies up to the next fraction of levels. The
+        slices are read in the background while the previous ones are
+        used, so a preview can be shown at once and then refined. The types
+        of the columns are the ones of sample.
+        """
+
+        self.random_key()
+        bounds = [0.] + sorted(levels)
+        pool = ThreadPoolExecutor(max_workers=1)
+        futures = [
+            pool.submit(self._slice, select, low, high, dtypes)
+            for low, high in zip(bounds[:-1], bounds[1:])
+        ]
+        pool.shutdown(wait=False)
+
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
     def get_true_groups(self, galaxies):
         """
         To extract halos in real space from the identity
         of the unique group identity. Galaxies must be
         extracted from the mock catalog.
+
+        Returns a GroupTable, computing the statistics of all the groups
+        at once, whose groupby method gives the pandas grouping.
+        """
+
+        return GroupTable(galaxies, key="group_id")
+
+    def _sorted_ids(self, snapshot, right_on):
+        """
+        The permutation sorting the identities of a snapshot, the sorted
+        identities and if they are unique, computed once by snapshot. The
+        snapshot must not be modified between two joins.
         """
 
-        return galaxies.groupby("group_id")
+        cache = self._join_cache
+        if cache is None or cache[0] is not snapshot or cache[1] != right_on:
+            ids = np.asarray(snapshot[right_on])
+            order = np.argsort(ids, kind="mergesort")
+            ids = ids[order]
+            unique = not np.any(ids[1:] == ids[:-1])
+            self._join_cache = (snapshot, right_on, order, ids, unique)
+        return self._join_cache[2:]
 
     def join_snapshot(
         self,
@@ -95,22 +464,70 @@ class ReadMock(object):
         snapshot,
         left_on=None,
         right_on=None,
+        columns=None,
     ):
         """
         A function to do the join between galaxies in the mock
         catalog and galaxies in the snapshot used to construct
         the mock catalog.
+
+        The identities of the snapshot are sorted once, then the galaxies
+        matched by binary search and only the columns of the snapshot
+        given in columns (by default all) gathered. The galaxies and the
+        snapshot may be DataFrames, structured arrays (as read with the
+        numpy backend) or dictionaries of columns. The result is the
+        DataFrame of pd.merge, which is used for identities which are not
+        unique integers.
         """
 
         # compatibility with old versions of the mock catalog
         self.left_on = left_on
         self.right_on = right_on
 
-        return pd.merge(
-            galaxies,
-            snapshot,
-            left_on=self.left_on,
-            right_on=self.right_on,
-        )
+        if columns is None:
+            columns = _names(snapshot)
+        elif self.right_on not in columns:
+            columns = [self.right_on] + list(columns)
+
+        left = np.asarray(galaxies[self.left_on])
+        right = np.asarray(snapshot[self.right_on])
+        keys = None
+        if left.dtype.kind in "iu" and right.dtype.kind in "iu":
+            order, ids, unique = self._sorted_ids(snapshot, self.right_on)
+            if unique:
+                keys = _exact_keys(left, ids)
+        if keys is None:
+            return pd.merge(
+                pd.DataFrame(galaxies),
+                pd.DataFrame(snapshot)[columns],
+                left_on=self.left_on,
+                right_on=self.right_on,
+            )
+
+        # the galaxies found in the snapshot, and their rows in it
+        left, ids = keys
+        position = np.searchsorted(ids, left)
+        position[position == ids.size] = 0
+        found = ids[position] == left if ids.size else \
+            np.zeros(left.size, dtype=bool)
+        rows = order[position[found]]
+
+        # the columns of both, with the suffixes of pd.merge
+        same_key = self.left_on == self.right_on
+        common = set(_names(galaxies)) & set(columns)
+        if same_key:
+            common.discard(self.left_on)
+
+        data = OrderedDict()
+        for column in _names(galaxies):
+            name = column + "_x" if column in common else column
+            data[name] = np.asarray(galaxies[column])[found]
+        for column in columns:
+            if same_key and column == self.right_on:
+                continue
+            name = column + "_y" if column in common else column
+            data[name] = np.asarray(snapshot[column])[rows]
+
+        return pd.DataFrame(data)
 
 # vim: set tw=79 :
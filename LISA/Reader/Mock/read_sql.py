@@ -1,9 +1,100 @@
 #!/usr/bin/env python3
 
+import os
+import threading
+import numpy as np
 import pandas as pd
 
+from collections import OrderedDict
+
 from querier import Querier
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+
+# the pragmas set on each new connection to a SQLite database: map the file
+# in memory, keep a large page cache (negative sizes are in KiB) and forbid
+# writes through the shared connections.
+PRAGMAS = {
+    "mmap_size": 1 << 30,
+    "cache_size": -(1 << 18),
+    "query_only": 1,
+}
+
+# the engines shared by all the readers, by database and access mode
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def _set_pragmas(pragmas):
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA {0} = {1}".format(name, value))
+        cursor.close()
+    return connect
+
+
+def get_engine(database, writable=False):
+    """
+    The engine of a SQLite database, shared by the whole process so that
+    the readers of the same database reuse the pooled connections and their
+    warm page cache. The pragmas are applied once, when the pool opens a
+    connection.
+
+    :params database: the path to the database.
+    :params writable: if the connections of the engine may write to the
+        database, the pragma query_only being disabled.
+    """
+    key = (os.path.abspath(database), writable)
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            engine = create_engine(
+                "sqlite:///{0}".format(key[0]),
+                poolclass=QueuePool,
+                pool_size=5,
+                max_overflow=10,
+                # the connections of the pool are used by several threads
+                connect_args={"check_same_thread": False},
+            )
+            pragmas = dict(PRAGMAS)
+            if writable:
+                pragmas["query_only"] = 0
+            event.listen(engine, "connect", _set_pragmas(pragmas))
+            _ENGINES[key] = engine
+    return engine
+
+
+def dispose_engines():
+    """
+    Close all the connections of the shared engines, to release the
+    databases.
+    """
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+
+
+# the backends of the results of the queries
+BACKENDS = ("pandas", "numpy")
+
+
+def _infer_dtype(values):
+    """
+    The numpy type of a field from its first values: float32 for the reals,
+    int64 for the integers, objects otherwise.
+    """
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, float):
+            return np.dtype(np.float32)
+        if isinstance(value, int):
+            return np.dtype(np.int64)
+        return np.dtype(object)
+    return np.dtype(np.float32)
 
 
 class ReadSQL(object):
@@ -12,13 +103,18 @@ class ReadSQL(object):
     A class to read data easily in a SQL database.
     """
 
-    def __init__(self, database, querier=Querier()):
+    def __init__(self, database, querier=Querier(), backend="pandas"):
         """
         Store the informations of the database.
+
+        :params backend: "pandas" to return the results of the queries as
+            DataFrames, "numpy" as structured arrays filled straight from
+            the cursor.
         """
 
         self.database = database
         self.querier = querier
+        self.backend = backend
 
     @property
     def database(self):
@@ -30,35 +126,170 @@ class ReadSQL(object):
 
         return self._querier
 
+    @property
+    def backend(self):
+
+        return self._backend
+
     @database.setter
     def database(self, database):
 
         self._database = database
-        self._conn = create_engine("sqlite:///{0}".format(self._database))
+        self._conn = get_engine(self._database)
 
     @querier.setter
     def querier(self, querier):
 
         self._querier = querier
 
-    def __call__(self, **kwargs):
+    @backend.setter
+    def backend(self, backend):
+
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend '{0}'.".format(backend))
+        self._backend = backend
+
+    def _query(self, **kwargs):
+        """
+        The SQL query built by the querier from the keyword arguments.
+        """
+
+        # reformat select statement
+        select = kwargs["select"].split(",")
+        kwargs.pop("select", None)
+
+        return self._querier(*select, **kwargs)
+
+    def __call__(self, dtypes=None, columns=False, **kwargs):
         """
         When calling the instance, executes
         a query passing arguments in keyword fashion
         to the query instance which creates a SQL query
         with its argument. The querier instance can be
         set with the ReadSQL instance.
-        """
 
-        # reformat select statement
-        select = kwargs["select"].split(",")
-        kwargs.pop("select", None)
+        With the numpy backend, the result is a structured array, whose
+        fields have the types given in the dictionary dtypes or else
+        float32 for the reals and int64 for the integers, or with columns
+        an ordered dictionary of the views of its fields.
+        """
 
         # the query
-        query = self._querier(*select, **kwargs)
+        query = self._query(**kwargs)
+
+        if self._backend == "numpy":
+            array = self.structured_query(str(query), dtypes=dtypes)
+            if columns:
+                return OrderedDict(
+                    (name, array[name]) for name in array.dtype.names
+                )
+            return array
 
         # return the query into a DataFrame
         return pd.read_sql(
             query,
             self._conn,
         )
+
+    def _fetch(self, query, params=(), chunksize=65536):
+        """
+        Executes a query through a DB-API cursor. Yields the number of rows
+        of the query and the names of its fields, then its rows by chunks
+        of chunksize.
+        """
+
+        connection = self._conn.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT COUNT(*) FROM ({0})".format(query), params)
+            count = cursor.fetchone()[0]
+
+            cursor.execute(query, params)
+            yield count, [description[0] for description in cursor.description]
+
+            rows = cursor.fetchmany(chunksize)
+            while rows:
+                if len(rows) > count:
+                    raise RuntimeError(
+                        "The database changed during the query."
+                    )
+                count -= len(rows)
+                yield rows
+                rows = cursor.fetchmany(chunksize)
+            cursor.close()
+        finally:
+            connection.close()
+
+    def structured_query(self, query, params=(), dtypes=None,
+                         chunksize=65536):
+        """
+        A SQL query, given as a string with its parameters, read by chunks
+        into a structured array allocated once from the number of rows of
+        the query. The types of the fields are given by the dictionary
+        dtypes, or inferred from the first rows.
+        """
+
+        dtypes = {} if dtypes is None else dtypes
+        chunks = self._fetch(query, params, chunksize)
+        try:
+            count, names = next(chunks)
+            rows = next(chunks, [])
+            dtype = np.dtype([
+                (
+                    name,
+                    dtypes[name] if name in dtypes
+                    else _infer_dtype(row[i] for row in rows),
+                )
+                for i, name in enumerate(names)
+            ])
+            array = np.empty(count, dtype=dtype)
+
+            start = 0
+            while rows:
+                array[start:start + len(rows)] = rows
+                start += len(rows)
+                rows = next(chunks, [])
+        finally:
+            chunks.close()
+
+        return array[:start]
+
+    def stream(self, chunksize=65536, dtype=np.float32, **kwargs):
+        """
+        Executes a query as when calling the instance, but fetches the rows
+        by chunks of chunksize into contiguous columns of type dtype,
+        allocated once from the number of rows of the query. Only one copy
+        of the data is kept in memory, without an intermediate DataFrame.
+        Returns an ordered dictionary of the columns, by name.
+        """
+
+        return self.stream_query(
+            str(self._query(**kwargs)), chunksize=chunksize, dtype=dtype,
+        )
+
+    def stream_query(self, query, params=(), chunksize=65536,
+                     dtype=np.float32):
+        """
+        As stream, for a SQL query given as a string with its parameters.
+        """
+
+        chunks = self._fetch(query, params, chunksize)
+        try:
+            count, names = next(chunks)
+            columns = OrderedDict(
+                (name, np.empty(count, dtype=dtype)) for name in names
+            )
+
+            start = 0
+            for rows in chunks:
+                # a chunk of rows, transposed to fill the columns
+                chunk = np.array(rows, dtype=dtype)
+                for i, column in enumerate(columns.values()):
+                    column[start:start + len(rows)] = chunk[:, i]
+                start += len(rows)
+        finally:
+            chunks.close()
+
+        return OrderedDict(
+            (name, column[:start]) for name, column in columns.items()
+        )
@@ -3,7 +3,7 @@
 
 import os
 
-__all__ = ["TEXTURE_DIR", "SHADERS_DIR"]
+__all__ = ["TEXTURE_DIR", "SHADERS_DIR", "CACHE_DIR"]
 
 # Directory in which all data are in:
 PREFIX = os.path.join(os.path.dirname(__file__), "../Data")
@@ -17,3 +17,12 @@ TEXTURE_DIR = os.path.abspath(
 SHADERS_DIR = os.path.abspath(
     os.path.join(PREFIX, "Shaders")
 )
+
+# Directory to place cached data in:
+CACHE_DIR = os.path.join(
+    os.environ.get(
+        "XDG_CACHE_HOME",
+        os.path.join(os.path.expanduser("~"), ".cache"),
+    ),
+    "LISA",
+)